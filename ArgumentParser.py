@@ -30,10 +30,14 @@ import OutputBackends
 from FriendlyArgumentParser import FriendlyArgumentParser
 from GSOnline import GSOnline
 
-ArgDefinitionCls = collections.namedtuple("ArgDefinition", [ "name", "args", "help" ])
+ArgDefinitionCls = collections.namedtuple("ArgDefinition", [ "name", "args", "optargs", "help" ])
 def ArgDefinition(**kwargs):
+	"""optargs are the indices of arguments that may be omitted; they are
+	passed as None then. They can only be omitted all at once."""
 	if "args" not in kwargs:
 		kwargs["args"] = tuple()
+	if "optargs" not in kwargs:
+		kwargs["optargs"] = tuple()
 	return ArgDefinitionCls(**kwargs)
 ParsedCommand = collections.namedtuple("ParsedCommand", [ "name", "args" ])
 
@@ -55,19 +59,50 @@ class ArgumentParser():
 		self._parser.add_argument("--txt-format", metavar = "fmtstr", type = str, help = "Sets the output string for the txt output backend. Named printf arguments must be used; recognized names are %s" % (", ".join(OutputBackends.OutputBackendTXT.get_known_args())))
 		self._parser.add_argument("--gstool-txt-format", action = "store_true", help = "Shortcut for --txt-format which sets the output format string that gstool uses")
 		self._parser.add_argument("--date-format", metavar = "fmtstr", type = str, default = "%Y-%m-%d %H:%M:%S", help = "Sets the strftime format string for the txt and csv output backends. Default is %(default)s")
+		self._parser.add_argument("--async-output", metavar = "policy", type = str, choices = [ "block", "dropoldest", "spill" ], help = "Run every output backend in its own writer thread behind a bounded queue so that slow outputs do not stall parsing or online readout. The policy determines what happens when the queue is full: wait for the writer, discard the oldest queued value or spill values to a temporary file. Possible options are %(choices)s, default is synchronous output")
+		self._parser.add_argument("--async-queue-size", metavar = "count", type = int, default = 10000, help = "Number of intervals that the queue of --async-output holds. Default is %(default)d")
+		self._parser.add_argument("--ringbuffer", metavar = "filename", type = str, help = "In online mode, additionally keep the most recent readings in a fixed size ring file that local programs can memory map to get the newest values without querying the output (see OnlineRing.py)")
+		self._parser.add_argument("--ringbuffer-size", metavar = "count", type = int, default = 1024, help = "Number of readings that the ring file of --ringbuffer holds. Default is %(default)d")
+		self._parser.add_argument("--journal-sync", metavar = "secs", type = float, default = 5, help = "Maximum frequency with which the journal output backend syncs its file to disk; records that arrive in between are synced together, at the latest after that time. 0 syncs every record. Default is %(default).0f seconds")
+		self._parser.add_argument("--compress-level", metavar = "level", type = int, choices = range(0, 10), help = "Compression level for output files that are compressed because their name ends in .gz, .bz2 or .xz (0-9, for xz this is the preset). Default depends on the compression method")
+		self._parser.add_argument("--compress-thread", action = "store_true", help = "Compress output files in a background thread so that compression runs in parallel to parsing")
+		self._parser.add_argument("--archive-block-size", metavar = "rows", type = int, default = 4096, help = "Number of intervals that the archive output backend compresses together in one block. Smaller blocks make reads of short time ranges faster, larger blocks compress better. Default is %(default)d")
+		self._parser.add_argument("--compact-hourly-after", metavar = "days", type = int, default = 30, help = "The 'compact' command merges intervals which are older than this into one interval per hour; 0 disables this stage. Default is %(default)d")
+		self._parser.add_argument("--compact-daily-after", metavar = "days", type = int, default = 365, help = "The 'compact' command merges intervals which are older than this into one interval per day; 0 disables this stage. Default is %(default)d")
+		self._parser.add_argument("--npz-doserate", action = "store_true", help = "Additionally store the dose rate in µSv/h as a column of files written by the npz output backend")
+		self._parser.add_argument("--sqlite-journal-mode", metavar = "mode", type = str, choices = [ "delete", "truncate", "persist", "memory", "wal", "off" ], default = "wal", help = "Journal mode of SQLite databases written by the sqlite output backend. Possible options are %(choices)s, default is %(default)s")
+		self._parser.add_argument("--sqlite-synchronous", metavar = "mode", type = str, choices = [ "off", "normal", "full", "extra" ], default = "normal", help = "Synchronous pragma of SQLite databases written by the sqlite output backend. Possible options are %(choices)s, default is %(default)s")
+		self._parser.add_argument("--sqlite-batch-size", metavar = "rows", type = int, default = 1000, help = "Number of rows that the sqlite output backend buffers before inserting them all at once. Default is %(default)d")
+		self._parser.add_argument("--sqlite-commit-rows", metavar = "rows", type = int, default = 10000, help = "The sqlite output backend commits after at most this many rows so that concurrent writers are not locked out during long imports. Default is %(default)d")
+		self._parser.add_argument("--sqlite-commit-interval", metavar = "secs", type = float, default = 10, help = "The sqlite output backend commits buffered rows after at most this many seconds (important for online mode). Default is %(default).0f")
+		self._parser.add_argument("--sqlite-busy-timeout", metavar = "secs", type = float, default = 30, help = "Time that the sqlite output backend waits for a database that is locked by another process before retrying. Default is %(default).0f")
+		self._parser.add_argument("--serial", metavar = "number", type = int, help = "Serial number of the device that the data comes from. It is stored with every interval by the sqlite and mysql output backends. By default, the serial number that the connected device reports is used; it is unknown when reading files without this option")
+		self._parser.add_argument("--overlap-policy", metavar = "policy", type = str, choices = [ "keep", "reject", "merge" ], default = "keep", help = "Determines what the sqlite output backend does with intervals that overlap intervals of the same device which are already stored: insert them anyway, skip them or merge them with the stored intervals (counting overlapping time only once). Requires schema version 4. With reject or merge, the watermark is not used (as with --nowatermark), so that old logs can fill gaps in the database. Possible options are %(choices)s, default is %(default)s")
+		self._parser.add_argument("--min-gap", metavar = "secs", type = int, default = 1, help = "Smallest uncovered time range that the 'gaps' command reports. Default is %(default)d")
+		self._parser.add_argument("--sqlite-shards", action = "store_true", help = "Split the data of the sqlite output backend over several database files: strftime substitutions in its filename are expanded with the start time of every interval instead of the current time, e.g. db/%%Y-%%m.sqlite for monthly shards. The finest granularity is one shard per hour")
+		self._parser.add_argument("--nowatermark", action = "store_true", help = "When writing to an existing SQLite database, also insert intervals that are older than the newest interval already stored. By default these are skipped so that repeated readouts do not create duplicates")
 		self._parser.add_argument("commands", metavar = "command", type = str, nargs = "+", help = "Commands that are processed by the Gamma Scout util, in order of occurence")
+		aggregations = "[" + "|".join(OutputBackends.OutputBackendAggregate.aggregations) + "]"
 		self._commands = [
 			ArgDefinition(name = "identify", help = "Displays information like the Gamma Scout software version and serial number of the device"),
 			ArgDefinition(name = "devidentify", help = "Output extended information about the Gamma Scout for development purposes"),
 			ArgDefinition(name = "synctime", help = "Synchronizes the time with the current local system time (not recommended)"),
 			ArgDefinition(name = "syncutctime", help = "Synchronizes the time with the current time in UTC (GMT+0), preferred way of syncing the Gamma Scout time"),
 			ArgDefinition(name = "settime", args = [ "YYYY-MM-DD-HH-MM-SS" ], help = "Sets the time to the user defined value"),
-		 	ArgDefinition(name = "readlog", args = [ "[txt|sqlite|csv|xml|bin|sql]", "[Filename/Connstr]" ], help = "Reads out Gamma Scout log in text format, SQLite3 format, CSV, XML or binary format and writes the results to the specified filename; only binary data can later on be imported back using the 'readbinlog' command"),
-		 	ArgDefinition(name = "readbinlog", args = [ "[Infile]", "[txt|sqlite|csv|xml|bin]", "[Outfile]" ], help = "Reads a Gamma Scout log from a previously written binary file"),
+		 	ArgDefinition(name = "readlog", args = [ "[txt|sqlite|csv|xml|bin|sql|archive|npz|store|influx|journal]", aggregations, "[Filename/Connstr]" ], optargs = [ 1 ], help = "Reads out Gamma Scout log in text format, SQLite3 format, CSV, XML, binary, archive or NumPy format and writes the results to the specified filename; only binary data can later on be imported back using the 'readbinlog' command. If an aggregation is given, only the hourly or daily sums are written"),
+		 	ArgDefinition(name = "readbinlog", args = [ "[Infile]", "[txt|sqlite|csv|xml|bin|archive|npz|store|influx|journal]", aggregations, "[Outfile]" ], optargs = [ 2 ], help = "Reads a Gamma Scout log from a previously written binary file or from a manifest file of a chunk store"),
+			ArgDefinition(name = "convert", args = [ "[Infile]", "[txt|sqlite|csv|xml|sql|archive|npz|influx|journal]", aggregations, "[Outfile]" ], optargs = [ 2 ], help = "Reads the intervals stored in a file written by the archive, journal or npz output backend and writes them in the specified format"),
+			ArgDefinition(name = "importcsv", args = [ "[Infiles]", "[txt|sqlite|csv|xml|sql|archive|npz|influx|journal]", aggregations, "[Outfile]" ], optargs = [ 2 ], help = "Imports CSV exports of the vendor's Gamma Scout Toolbox software (semicolon separated, time denotes the end of the interval) in the given order. Infiles is a comma separated list of filenames or glob patterns"),
+			ArgDefinition(name = "merge", args = [ "[Infiles]", "[txt|sqlite|csv|xml|sql|archive|npz|influx|journal]", aggregations, "[Outfile]" ], optargs = [ 2 ], help = "Merges any number of CSV (also Toolbox exports), TXT, binary, archive, journal or npz exports into one timeline sorted by time, dropping intervals that duplicate or overlap intervals which were already written. Infiles is a comma separated list of filenames or glob patterns"),
+			ArgDefinition(name = "slice", args = [ "[Infile]", "[From]", "[To]", "[Outfile]" ], help = "Copies all rows of a CSV or TXT file written by the respective output backend that start within the given time range (YYYY-MM-DD-HH-MM-SS or YYYY-MM-DD, end exclusive) to the output file. The rows are found by binary search, so this is fast even for huge files. The file must have been written with the same --date-format"),
 			ArgDefinition(name = "clearlog", help = "Deletes the Gamma Scout log"),
 			ArgDefinition(name = "readcfg", args = [ "[Filename]" ], help = "Reads out the configuration blob and writes it in the specified file in binary format"),
 			ArgDefinition(name = "devicereset", help = "Completely resets the device to its factory defaults. Do not perform this operation unless you have a good reason to. Requires the --force option to be set in order to work"),
-			ArgDefinition(name = "online", args = [ "[Intervaltime]", "[txt|csv|sql]", "[Filename/Connstr]" ], help = "Switches the Gamma Scout into online-mode and records the values it receives continuously into the given file in the specified syntax (every n seconds). Valid intervals are " + GSOnline.possible_interval_str() + " seconds"),
+			ArgDefinition(name = "online", args = [ "[Intervaltime]", "[txt|csv|sql|sqlite|influx|journal]", "[Filename/Connstr]" ], help = "Switches the Gamma Scout into online-mode and records the values it receives continuously into the given file in the specified syntax (every n seconds). Valid intervals are " + GSOnline.possible_interval_str() + " seconds"),
+			ArgDefinition(name = "migratedb", args = [ "[Filename]" ], help = "Upgrades an SQLite database that was written by an older version of the sqlite output backend in place to the current database schema"),
+			ArgDefinition(name = "compact", args = [ "[Filename]" ], help = "Downsamples old intervals in an SQLite database in place into hourly and daily intervals (see --compact-hourly-after and --compact-daily-after), summing counts and durations exactly. Runs incrementally in short transactions and can be used while the database is being written to"),
+			ArgDefinition(name = "gaps", args = [ "[Filename]" ], help = "Lists all time ranges of an SQLite database that are not covered by any interval of the respective device"),
+			ArgDefinition(name = "overlaps", args = [ "[Filename]" ], help = "Lists all pairs of intervals of the same device in an SQLite database that overlap each other, using the interval index of schema version 4"),
 			ArgDefinition(name = "switchmode", args = [ "[standard|pc|online]" ], help = "Switches the Gamma Scout into the desired mode and then exits (leaving it in that mode)"),
 		]
 		self._knowncommands = { cmd.name: cmd for cmd in self._commands }
@@ -78,10 +113,13 @@ class ArgumentParser():
 			print(file = sys.stderr)
 			print("commands:", file = sys.stderr)
 			for cmd in self._commands:
-				if len(cmd.args) == 0:
-					print("  %s" % (cmd.name), file = sys.stderr)
-				else:
-					print("  %s:%s" % (cmd.name, ":".join(cmd.args)), file = sys.stderr)
+				cmdline = cmd.name
+				for (argno, arg) in enumerate(cmd.args):
+					if argno in cmd.optargs:
+						cmdline += "(:%s)" % (arg)
+					else:
+						cmdline += ":" + arg
+				print("  %s" % (cmdline), file = sys.stderr)
 				for line in textwrap.wrap(cmd.help, initial_indent = "    ", subsequent_indent = "    "):
 					print(line, file = sys.stderr)
 			print(file = sys.stderr)
@@ -98,8 +136,27 @@ class ArgumentParser():
 			print("    %s --nodevice readbinlog:v2log.bin:sqlite:database.sqlite" % (sys.argv[0]), file = sys.stderr)
 			print("  Read in v1 binary blob log and print it on standard output:", file = sys.stderr)
 			print("    %s --nodevice -p v1 readbinlog:v1log.bin:txt:-" % (sys.argv[0]), file = sys.stderr)
+			print("  Keep every dump of the log in a deduplicating store and read one of them back:", file = sys.stderr)
+			print("    %s readlog:store:root=/home/joe/gsstore" % (sys.argv[0]), file = sys.stderr)
+			print("    %s --nodevice readbinlog:/home/joe/gsstore/2013/07/2013-07-15-16-40-32.manifest:txt:-" % (sys.argv[0]), file = sys.stderr)
 			print("  Read Gamma Scout log into file that is named after current date and time:", file = sys.stderr)
 			print("    %s readlog:txt:%%Y/%%m/%%Y-%%m-%%d-%%H-%%M-%%S.txt" % (sys.argv[0]), file = sys.stderr)
+			print("  Read out Gamma Scout log and write hourly sums into a CSV file:", file = sys.stderr)
+			print("    %s readlog:csv:hourly:hourly.csv" % (sys.argv[0]), file = sys.stderr)
+			print("  Record online readings every 10 seconds and push them to a time series database:", file = sys.stderr)
+			print("    %s online:10:influx:host=localhost,port=8086,db=gammascout" % (sys.argv[0]), file = sys.stderr)
+			print("  Import a Gamma Scout Toolbox export into an SQLite database:", file = sys.stderr)
+			print("    %s --nodevice --serial 123456 importcsv:toolbox.csv:sqlite:database.sqlite" % (sys.argv[0]), file = sys.stderr)
+			print("  Merge all CSV exports of 2013 into one file without duplicates:", file = sys.stderr)
+			print("    %s --nodevice \"merge:2013/*/*.csv:csv:2013.csv\"" % (sys.argv[0]), file = sys.stderr)
+			print("  Extract the data of one day from a large CSV file:", file = sys.stderr)
+			print("    %s --nodevice slice:history.csv:2013-07-15:2013-07-16:day.csv" % (sys.argv[0]), file = sys.stderr)
+			print("  Convert a compact archive file into a CSV file:", file = sys.stderr)
+			print("    %s --nodevice convert:history.gsca:csv:history.csv" % (sys.argv[0]), file = sys.stderr)
+			print("  Upgrade an existing SQLite database to the current schema version:", file = sys.stderr)
+			print("    %s --nodevice migratedb:database.sqlite" % (sys.argv[0]), file = sys.stderr)
+			print("  Keep full resolution for one week, hourly values for a year and daily values beyond:", file = sys.stderr)
+			print("    %s --nodevice --compact-hourly-after 7 --compact-daily-after 365 compact:database.sqlite" % (sys.argv[0]), file = sys.stderr)
 			print("  Read out log, write it to binary file and to database and clear log of Gamma Scout afterwards:", file = sys.stderr)
 			print("    %s readlog:bin:%%Y/%%m/%%Y-%%m-%%d-%%H-%%M-%%S.txt readlog:sqlite:database.sqlite clearlog" % (sys.argv[0]), file = sys.stderr)
 			print()
@@ -107,8 +164,16 @@ class ArgumentParser():
 			notes = [
 				"for the txt, csv and xml output backends, '-' may be speficied as filename which will cause the output to be printed on stdout",
 				"filenames support strftime substitutions",
+				"output files of the txt, csv, xml, sql and bin backends are compressed transparently if their filename ends in .gz, .bz2 or .xz; compressed binary files can be read back directly with 'readbinlog'",
+				"the 'archive' output backend writes a compact, block-compressed columnar file with a time index; it can be plotted by GammaPlot directly and converted to the other formats with the 'convert' command",
+				"the 'npz' output backend writes the columns tfrom, duration, counts (and usvperhr with --npz-doserate) as NumPy arrays into an uncompressed .npz file; it requires NumPy",
+				"the 'store' output backend puts binary dumps into a deduplicating chunk store, so that repeated dumps of the same log only need space for the new data. It takes a connection string with the keys root (directory of the store) and name (name of the manifest, supports strftime substitutions, default %Y/%m/%Y-%m-%d-%H-%M-%S). The resulting .manifest file can be used as input file for 'readbinlog'",
+				"with an aggregation, intervals are summed up into UTC hours or days while parsing. Intervals that cross a boundary are split with their counts distributed proportionally, every sum starts at the first covered time and its duration is the covered time, so dose rates stay correct across gaps",
+				"the 'influx' output backend writes the InfluxDB line protocol and takes a connection string. Either file (output filename, '-' for stdout) or host (HTTP server whose /write endpoint receives the data) must be given; further keys are port, db, measurement, batchsize (lines per request), batchsecs (maximum age of a batch), gzip (set to 0 to send uncompressed requests), retries, timeout and maxpending (lines that are kept while the server is unreachable). The gammainfluxsim script provides a local stand-in server for testing",
+				"the 'journal' output backend appends fixed size, CRC protected binary records to a file and syncs it to disk at most every --journal-sync seconds, which makes online recordings crash safe without syncing every line. A damaged tail after a crash is discarded when the journal is opened again; journals can be read back with the 'convert' command",
 				"if filename specification contain subdirectories, they will be created if they do not exist",
-				"the 'sql' output backend does not take a filename, but a connection string in the form key1=value1,key2=value2,... and so on. Recognized keys are dbdialect, dbname, tablename, file",
+				"the 'sql' output backend does not take a filename, but a connection string in the form key1=value1,key2=value2,... and so on. Recognized keys are dialect, dbname, tablename, file, rowsperinsert and bytesperinsert (limits for each multi-row INSERT statement)",
+				"the 'mysql' output backend also takes a connection string. Recognized keys are host, port, unixsocket, user, password, dbname, tablename, batchsize (rows per multi-row INSERT) and bulkload (set to 1 to import all rows at once using LOAD DATA LOCAL INFILE)",
 			]
 			for note in notes:
 				for line in textwrap.wrap(note, initial_indent = "  - ", subsequent_indent = "    "):
@@ -134,8 +199,14 @@ class ArgumentParser():
 				self._parser.error("'%s' is not a known command; known commands are %s." % (cmdname, ", ".join(sorted(list(self._knowncommands)))))
 
 			cmddef = self._knowncommands[cmdname]
-			if len(cmdargs) != len(cmddef.args):
-				self._parser.error("Command '%s' takes %d parameter(s), but you supplied %d parameter(s)." % (cmdname, len(cmddef.args), len(cmdargs)))
+			if (len(cmddef.optargs) > 0) and (len(cmdargs) == len(cmddef.args) - len(cmddef.optargs)):
+				cmdargs = iter(cmdargs)
+				cmdargs = [ None if (argno in cmddef.optargs) else next(cmdargs) for argno in range(len(cmddef.args)) ]
+			elif len(cmdargs) != len(cmddef.args):
+				if len(cmddef.optargs) == 0:
+					self._parser.error("Command '%s' takes %d parameter(s), but you supplied %d parameter(s)." % (cmdname, len(cmddef.args), len(cmdargs)))
+				else:
+					self._parser.error("Command '%s' takes %d or %d parameter(s), but you supplied %d parameter(s)." % (cmdname, len(cmddef.args) - len(cmddef.optargs), len(cmddef.args), len(cmdargs)))
 
 			cmd = ParsedCommand(cmdname, cmdargs)
 			self._parsedcmds.append(cmd)
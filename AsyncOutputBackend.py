@@ -0,0 +1,248 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import queue
+import pickle
+import logging
+import tempfile
+import threading
+
+from OutputBackends import OutputBackend
+from Exceptions import InvalidArgumentException
+
+class AsyncOutputBackend(OutputBackend):
+	"""Decouples an output backend from the producer of intervals by putting a
+	bounded queue and a writer thread in between. The wrapped backend is
+	created, used and closed exclusively by the writer thread (SQLite
+	connections, for example, must not change threads). When the queue is
+	full, the policy decides what happens:
+
+		block:		The producer waits until there is room again.
+		dropoldest:	The oldest queued interval is discarded.
+		spill:		Intervals go to a temporary file on disk until the writer
+					has caught up; ordering is preserved."""
+	POLICIES = [ "block", "dropoldest", "spill" ]
+	_SYNCMETHODS = set([ "initdata", "setserial" ])
+
+	def __init__(self, backendfactory, policy = "block", queuesize = 10000):
+		OutputBackend.__init__(self, None, None)
+		if policy not in AsyncOutputBackend.POLICIES:
+			raise InvalidArgumentException("Async output policy must be one of %s, but '%s' was given." % (", ".join(AsyncOutputBackend.POLICIES), policy))
+		self._log = logging.getLogger("gsu.output." + self.__class__.__name__)
+		self._policy = policy
+		self._queue = queue.Queue(maxsize = queuesize)
+		self._lock = threading.Lock()
+		self._spill = None
+		self._spillcount = 0
+		self._spilling = False
+		self._exception = None
+		self._closed = False
+		self._metrics = {
+			"enqueued":		0,
+			"written":		0,
+			"dropped":		0,
+			"spilled":		0,
+			"maxdepth":		0,
+		}
+
+		self._backend = None
+		self._syncdone = threading.Event()
+		self._started = threading.Event()
+		self._thread = threading.Thread(target = self._run, args = (backendfactory, ))
+		self._thread.daemon = True
+		self._thread.start()
+		self._started.wait()
+		self._checkexception()
+
+	def _checkexception(self):
+		if self._exception is not None:
+			(exception, self._exception) = (self._exception, None)
+			raise exception
+
+	def getmetrics(self):
+		"""Returns a copy of the counters of this stage together with the
+		current queue depth."""
+		with self._lock:
+			metrics = dict(self._metrics)
+			metrics["depth"] = self._queue.qsize()
+			metrics["spilldepth"] = self._spillcount
+		return metrics
+
+	def _tospill(self, item):
+		if self._spill is None:
+			self._spill = tempfile.TemporaryFile(prefix = "gsu_spill_")
+		pickle.dump(item, self._spill)
+		self._spillcount += 1
+		if (item is not None) and (item[0] == "newinterval"):
+			self._metrics["spilled"] += 1
+
+	def _enqueue(self, item, maydrop = True):
+		if self._policy == "block":
+			self._queue.put(item)
+		elif self._policy == "dropoldest":
+			while True:
+				try:
+					self._queue.put_nowait(item)
+					break
+				except queue.Full:
+					if not maydrop:
+						# Wait for the writer instead
+						self._queue.put(item)
+						break
+					try:
+						self._queue.get_nowait()
+						with self._lock:
+							self._metrics["dropped"] += 1
+					except queue.Empty:
+						pass
+		else:
+			with self._lock:
+				if not self._spilling:
+					try:
+						self._queue.put_nowait(item)
+					except queue.Full:
+						self._spilling = True
+				if self._spilling:
+					self._tospill(item)
+		with self._lock:
+			if maydrop:
+				self._metrics["enqueued"] += 1
+			self._metrics["maxdepth"] = max(self._metrics["maxdepth"], self._queue.qsize())
+
+	def _takespill(self):
+		"""Called by the writer thread when the queue ran empty. Returns the
+		spill file with all items that have been spilled so far (or None). The
+		producer then goes back to the queue and, should it fill up again,
+		starts a new spill file: everything it queues is newer than the items
+		of the spill file that was taken, which the writer processes first."""
+		with self._lock:
+			if not self._queue.empty():
+				# The producer has refilled the queue meanwhile; its items are
+				# older than the spilled ones
+				return None
+			self._spilling = False
+			if self._spillcount == 0:
+				return None
+			(spill, count) = (self._spill, self._spillcount)
+			self._spill = None
+			self._spillcount = 0
+		spill.seek(0)
+		return (spill, count)
+
+	def _processspill(self, spill, count):
+		running = True
+		try:
+			for i in range(count):
+				if not self._safeprocess(pickle.load(spill)):
+					running = False
+					break
+		finally:
+			spill.close()
+		return running
+
+	def _process(self, item):
+		if item is None:
+			return False
+		(methodname, args) = item
+		getattr(self._backend, methodname)(*args)
+		if methodname == "newinterval":
+			with self._lock:
+				self._metrics["written"] += 1
+		return True
+
+	def _run(self, backendfactory):
+		try:
+			self._backend = backendfactory()
+		except Exception as e:
+			self._exception = e
+			self._started.set()
+			return
+		self._started.set()
+
+		running = True
+		while running:
+			try:
+				item = self._queue.get_nowait()
+			except queue.Empty:
+				spill = self._takespill() if (self._policy == "spill") else None
+				if spill is not None:
+					running = self._processspill(*spill)
+					continue
+				# Nothing can be spilled before the queue has filled up again,
+				# so waiting for the next item is safe
+				item = self._queue.get()
+			running = self._safeprocess(item)
+
+		try:
+			self._backend.close()
+		except Exception as e:
+			if self._exception is None:
+				self._exception = e
+
+	def _safeprocess(self, item):
+		if self._exception is not None:
+			# Backend failed before, discard everything until end of stream
+			if (item is not None) and (item[0] in AsyncOutputBackend._SYNCMETHODS):
+				self._syncdone.set()
+			return item is not None
+		try:
+			return self._process(item)
+		except Exception as e:
+			self._exception = e
+			return True
+		finally:
+			if (item is not None) and (item[0] in AsyncOutputBackend._SYNCMETHODS):
+				self._syncdone.set()
+
+	def _callsync(self, methodname, args):
+		# Wait until the backend has processed the call, so that a full queue
+		# can never cause it to be discarded
+		self._checkexception()
+		self._syncdone.clear()
+		self._enqueue((methodname, args), maydrop = False)
+		self._syncdone.wait()
+		self._checkexception()
+
+	def setserial(self, serial):
+		self._callsync("setserial", (serial, ))
+
+	def initdata(self, logsize, datablob):
+		self._callsync("initdata", (logsize, datablob))
+
+	def newinterval(self, fromtime, totime, counts):
+		self._checkexception()
+		self._enqueue(("newinterval", (fromtime, totime, counts)))
+
+	def flush(self):
+		self._checkexception()
+		self._enqueue(("flush", tuple()), maydrop = False)
+
+	def close(self):
+		if self._closed:
+			return
+		self._closed = True
+		self._enqueue(None, maydrop = False)
+		self._thread.join()
+		metrics = self.getmetrics()
+		self._log.info("Async output stage: %(enqueued)d intervals queued, %(written)d written, %(dropped)d dropped, %(spilled)d spilled to disk, maximum queue depth %(maxdepth)d" % (metrics))
+		self._checkexception()
@@ -0,0 +1,151 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+
+from Exceptions import InvalidArgumentException
+
+class ChunkStore():
+	"""Deduplicating store for binary blobs. Blobs are split into chunks at
+	content-defined boundaries (a rolling gear hash over the last 32 bytes),
+	so that data which is shared between two blobs results in identical
+	chunks even if it is shifted. Every chunk is stored once under its
+	SHA-256 hash in <root>/chunks/; for every blob, a JSON manifest lists the
+	chunks it consists of. The location of the chunk directory is stored
+	relative to the manifest, so the whole store may be moved around."""
+	_MINCHUNK = 512
+	_MAXCHUNK = 16384
+	_BOUNDARYMASK = 0x7ff << 21					# Average chunk size about 2 kB
+	_GEAR = [ int.from_bytes(hashlib.sha256(bytes([ i ])).digest()[:4], "little") for i in range(256) ]
+
+	def __init__(self, root):
+		self._log = logging.getLogger("gsu.store." + self.__class__.__name__)
+		self._root = root
+		self._chunkdir = os.path.join(root, "chunks")
+
+	@staticmethod
+	def split(data):
+		"""Returns the list of chunks that data is split into."""
+		gear = ChunkStore._GEAR
+		mask = ChunkStore._BOUNDARYMASK
+		chunks = [ ]
+		start = 0
+		length = len(data)
+		while start < length:
+			end = min(start + ChunkStore._MAXCHUNK, length)
+			pos = start + ChunkStore._MINCHUNK
+			if pos >= end:
+				pos = end
+			else:
+				h = 0
+				while pos < end:
+					h = ((h << 1) + gear[data[pos]]) & 0xffffffff
+					pos += 1
+					if (h & mask) == 0:
+						break
+			chunks.append(data[start : pos])
+			start = pos
+		return chunks
+
+	@staticmethod
+	def _chunkpath(chunkdir, digest):
+		return os.path.join(chunkdir, digest[:2], digest[2:])
+
+	def _putchunk(self, chunk):
+		"""Stores the chunk unless it is already present and returns its hash
+		value and if it was newly written."""
+		digest = hashlib.sha256(chunk).hexdigest()
+		path = ChunkStore._chunkpath(self._chunkdir, digest)
+		if os.path.exists(path):
+			return (digest, False)
+
+		directory = os.path.dirname(path)
+		try:
+			os.makedirs(directory)
+		except OSError:
+			pass
+
+		# Write to a temporary file first and rename it, so that a chunk file
+		# is either complete or not there at all
+		(fd, tmpname) = tempfile.mkstemp(dir = directory, prefix = ".tmp")
+		with os.fdopen(fd, "wb") as f:
+			f.write(chunk)
+		os.rename(tmpname, path)
+		return (digest, True)
+
+	def put(self, manifestname, data):
+		"""Stores data and writes the manifest file for it."""
+		(chunks, newchunks, newbytes) = ([ ], 0, 0)
+		for chunk in ChunkStore.split(data):
+			(digest, isnew) = self._putchunk(chunk)
+			chunks.append(digest)
+			if isnew:
+				newchunks += 1
+				newbytes += len(chunk)
+
+		manifest = {
+			"version":		1,
+			"size":			len(data),
+			"sha256":		hashlib.sha256(data).hexdigest(),
+			"chunkdir":		os.path.relpath(self._chunkdir, os.path.dirname(os.path.abspath(manifestname))),
+			"chunks":		chunks,
+		}
+		with open(manifestname, "w") as f:
+			json.dump(manifest, f, indent = 1)
+			f.write("\n")
+		self._log.info("Stored %d bytes in %d chunks, %d chunks (%d bytes) of which were new" % (len(data), len(chunks), newchunks, newbytes))
+
+	@staticmethod
+	def get(manifestname):
+		"""Reassembles the blob that is described by the manifest file and
+		verifies all hash values."""
+		try:
+			with open(manifestname) as f:
+				manifest = json.load(f)
+		except ValueError as e:
+			raise InvalidArgumentException("Manifest '%s' is corrupt: %s" % (manifestname, str(e)))
+		if manifest.get("version") != 1:
+			raise InvalidArgumentException("Manifest '%s' has unsupported version %s." % (manifestname, str(manifest.get("version"))))
+
+		chunkdir = os.path.join(os.path.dirname(os.path.abspath(manifestname)), manifest["chunkdir"])
+		data = [ ]
+		for digest in manifest["chunks"]:
+			path = ChunkStore._chunkpath(chunkdir, digest)
+			try:
+				with open(path, "rb") as f:
+					chunk = f.read()
+			except IOError:
+				raise InvalidArgumentException("Chunk %s referenced by manifest '%s' is missing from store." % (digest, manifestname))
+			if hashlib.sha256(chunk).hexdigest() != digest:
+				raise InvalidArgumentException("Chunk %s referenced by manifest '%s' is corrupt." % (digest, manifestname))
+			data.append(chunk)
+
+		data = b"".join(data)
+		if (len(data) != manifest["size"]) or (hashlib.sha256(data).hexdigest() != manifest["sha256"]):
+			raise InvalidArgumentException("Data reassembled from manifest '%s' does not match its recorded hash value." % (manifestname))
+		return data
+
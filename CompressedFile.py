@@ -0,0 +1,144 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+class ThreadedWriter(io.RawIOBase):
+	"""Hands all written data over to a background thread which writes it to
+	the wrapped binary file. Compressors release the GIL while they work, so
+	compression then runs in parallel to whatever produces the data."""
+	_FLUSH = object()
+
+	def __init__(self, f, maxqueue = 64):
+		io.RawIOBase.__init__(self)
+		self._f = f
+		self._queue = queue.Queue(maxsize = maxqueue)
+		self._exception = None
+		self._thread = threading.Thread(target = self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+		while True:
+			data = self._queue.get()
+			if data is None:
+				break
+			if self._exception is None:
+				try:
+					if data is ThreadedWriter._FLUSH:
+						self._f.flush()
+					else:
+						self._f.write(data)
+				except Exception as e:
+					self._exception = e
+
+	def _checkexception(self):
+		if self._exception is not None:
+			raise self._exception
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self._checkexception()
+		data = bytes(data)
+		self._queue.put(data)
+		return len(data)
+
+	def flush(self):
+		# Also called by close() after the thread has ended
+		if self._thread.is_alive():
+			self._checkexception()
+			self._queue.put(ThreadedWriter._FLUSH)
+
+	def close(self):
+		if not self.closed:
+			self._queue.put(None)
+			self._thread.join()
+			self._f.close()
+			io.RawIOBase.close(self)
+			self._checkexception()
+
+
+class FlushingWriter(io.BufferedWriter):
+	"""Buffered writer that also flushes the wrapped file when flushed, so
+	that compressors emit everything written so far."""
+	def flush(self):
+		io.BufferedWriter.flush(self)
+		if not self.raw.closed:
+			self.raw.flush()
+
+
+class CompressedFile():
+	"""Opens files with transparent compression, which is chosen according to
+	the filename suffix."""
+	_modules = {
+		".gz":		gzip,
+		".bz2":		bz2,
+		".xz":		lzma,
+	}
+
+	@staticmethod
+	def compression(filename):
+		suffix = os.path.splitext(filename)[1].lower()
+		if suffix in CompressedFile._modules:
+			return suffix
+		return None
+
+	@staticmethod
+	def _openbinary(filename, mode, level, buffersize):
+		suffix = CompressedFile.compression(filename)
+		if suffix is None:
+			return open(filename, mode, buffering = buffersize)
+
+		module = CompressedFile._modules[suffix]
+		if (level is None) or ("r" in mode):
+			return module.open(filename, mode)
+		elif module is lzma:
+			return lzma.open(filename, mode, preset = level)
+		else:
+			return module.open(filename, mode, compresslevel = level)
+
+	@staticmethod
+	def open(filename, mode = "rb", level = None, threaded = False, buffersize = 256 * 1024):
+		"""Opens the file in binary ("rb", "wb") or text ("r", "w", always UTF-8)
+		mode. level is the compression level (or xz preset) and ignored for
+		uncompressed files. If threaded is set, compression of written data
+		happens in a background thread."""
+		assert(mode in [ "r", "w", "rb", "wb" ])
+		binmode = mode[0] + "b"
+		compressed = CompressedFile.compression(filename) is not None
+		f = CompressedFile._openbinary(filename, binmode, level, buffersize)
+		if compressed and (binmode == "wb"):
+			if threaded:
+				f = ThreadedWriter(f)
+			f = FlushingWriter(f, buffer_size = buffersize)
+		if mode in [ "r", "w" ]:
+			f = io.TextIOWrapper(f, encoding = "utf-8")
+		return f
@@ -0,0 +1,136 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import time
+import logging
+import itertools
+
+from DatabaseSchema import DatabaseSchema
+
+class DatabaseCompactor():
+	"""Downsamples old intervals of a version 3 database in place. All rows of
+	a stage that start within the same UTC bucket (e.g. one hour) and come
+	from the same device are replaced by a single row which starts at the
+	earliest tfrom and whose duration and counts are the exact sums of the
+	replaced rows, so that total counts and dose rates are preserved. Stages
+	run from the finest to the coarsest bucket.
+
+	Every stage remembers up to which time it has compacted the database in
+	the metadata table, so that subsequent runs only look at new data. Rows
+	that were inserted later but start before that time (e.g. by merging old
+	exports) are found by their id, which is larger than that of all rows
+	that existed when the previous run started; only their buckets are
+	compacted again. Work is done in transactions that cover at most one day
+	of data each, so a database that is written to concurrently is never
+	locked for long."""
+	_WINDOW = 86400
+
+	def __init__(self, db):
+		self._log = logging.getLogger("gsu.db." + self.__class__.__name__)
+		self._db = db
+		self._stages = [ ]
+
+	def addstage(self, name, bucketsecs, minagesecs):
+		"""Compacts all intervals that are older than minagesecs to buckets of
+		bucketsecs seconds."""
+		self._stages.append((name, bucketsecs, minagesecs))
+		return self
+
+	def _nextrow(self, fromtime):
+		(tfrom, ) = self._db.execute("SELECT MIN(tfrom) FROM data WHERE tfrom >= ?;", fromtime).fetchone()
+		return tfrom
+
+	def _compactwindow(self, bucketsecs, windowfrom, windowto):
+		groups = self._db.execute("""SELECT serial, tfrom - (tfrom % ?) AS bucket, MIN(tfrom), SUM(duration), SUM(counts), COUNT(*) FROM data
+			WHERE (tfrom >= ?) AND (tfrom < ?) GROUP BY serial, bucket HAVING COUNT(*) > 1;""", bucketsecs, windowfrom, windowto).fetchall()
+		removed = 0
+		for (serial, bucket, tfrom, duration, counts, rowcount) in groups:
+			self._db.execute("DELETE FROM data WHERE (serial IS ?) AND (tfrom >= ?) AND (tfrom < ?);", serial, bucket, bucket + bucketsecs)
+			self._db.execute("INSERT INTO data (serial, tfrom, duration, counts) VALUES (?, ?, ?, ?);", serial, tfrom, duration, counts)
+			removed += rowcount - 1
+		return (len(groups), removed)
+
+	def _compactlate(self, bucketsecs, lastid, upto):
+		"""Compacts the buckets before upto that received rows with an id
+		larger than lastid."""
+		buckets = [ bucket for (bucket, ) in self._db.execute("SELECT DISTINCT tfrom - (tfrom % ?) AS bucket FROM data WHERE (id > ?) AND (tfrom < ?) ORDER BY bucket;", bucketsecs, lastid, upto).fetchall() ]
+		(aggregates, removed) = (0, 0)
+		for (day, daybuckets) in itertools.groupby(buckets, key = lambda bucket: bucket - (bucket % DatabaseCompactor._WINDOW)):
+			self._db.execute("BEGIN IMMEDIATE;")
+			for bucket in daybuckets:
+				(bucketaggregates, bucketremoved) = self._compactwindow(bucketsecs, bucket, bucket + bucketsecs)
+				aggregates += bucketaggregates
+				removed += bucketremoved
+			self._db.commit()
+		return (aggregates, removed)
+
+	def _compactstage(self, name, bucketsecs, cutoff):
+		key = "compact_%s_upto" % (name)
+		idkey = "compact_%s_lastid" % (name)
+		cutoff -= cutoff % bucketsecs
+		# Rows inserted from now on (including the aggregates of this run) are
+		# checked again by the next run if they start before its upto
+		(startid, ) = self._db.execute("SELECT MAX(id) FROM data;").fetchone()
+		upto = DatabaseSchema.getmetadata(self._db, key)
+		lastid = DatabaseSchema.getmetadata(self._db, idkey)
+		(aggregates, removed) = (0, 0)
+		if upto is None:
+			upto = self._nextrow(0)
+			if upto is None:
+				return (0, 0)
+			upto -= upto % bucketsecs
+		else:
+			upto = int(upto)
+			if lastid is not None:
+				(aggregates, removed) = self._compactlate(bucketsecs, int(lastid), upto)
+
+		while upto < cutoff:
+			# Skip over time ranges that do not contain any data
+			nextrow = self._nextrow(upto)
+			if (nextrow is None) or (nextrow >= cutoff):
+				windowto = cutoff
+			else:
+				upto = nextrow - (nextrow % bucketsecs)
+				windowto = min(cutoff, upto + max(bucketsecs, DatabaseCompactor._WINDOW))
+
+			self._db.execute("BEGIN IMMEDIATE;")
+			if upto < windowto:
+				(windowaggregates, windowremoved) = self._compactwindow(bucketsecs, upto, windowto)
+				aggregates += windowaggregates
+				removed += windowremoved
+			DatabaseSchema.setmetadata(self._db, key, windowto)
+			self._db.commit()
+			upto = windowto
+		if startid is not None:
+			self._db.execute("BEGIN IMMEDIATE;")
+			DatabaseSchema.setmetadata(self._db, idkey, startid)
+			self._db.commit()
+		return (aggregates, removed)
+
+	def compact(self, now = None):
+		if now is None:
+			now = int(time.time())
+		for (name, bucketsecs, minagesecs) in self._stages:
+			(aggregates, removed) = self._compactstage(name, bucketsecs, now - minagesecs)
+			self._log.info("Compaction stage %s: %d rows merged into %d aggregates" % (name, removed + aggregates, aggregates))
+
@@ -0,0 +1,214 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import sqlite3
+import logging
+import calendar
+import datetime
+
+class DatabaseSchema():
+	"""Knows about the layout of the SQLite databases that are written by the
+	sqlite output backend. Version 1 stores tfrom/tto as text timestamps,
+	version 2 stores tfrom as integer seconds since the epoch (UTC) together
+	with the interval duration in seconds and has an index on tfrom. Version
+	3 adds the serial number of the device (NULL if unknown) with an index on
+	(serial, tfrom) and a ledger of all readouts. Version 4 adds an R*Tree
+	over (tfrom, tto, serial) which is kept up to date by triggers. R*Tree
+	coordinates are single precision floats that are rounded outwards, so
+	every lookup has to be checked against the data table. (The integer
+	variant rtree_i32 would be exact, but its signed 32 bit coordinates
+	cannot hold times after January 2038, at which point every insert would
+	fail in the trigger.)"""
+	CURRENT_VERSION = 4
+
+	_log = logging.getLogger("gsu.db.DatabaseSchema")
+
+	@staticmethod
+	def datetime_to_epoch(timestamp):
+		return calendar.timegm(timestamp.utctimetuple())
+
+	@staticmethod
+	def epoch_to_datetime(epoch):
+		return datetime.datetime.utcfromtimestamp(epoch)
+
+	@staticmethod
+	def _havetable(db, tablename):
+		return db.execute("SELECT name FROM sqlite_master WHERE (type = 'table') AND (name = ?);", tablename).fetchone() is not None
+
+	@staticmethod
+	def getversion(db):
+		"""Returns the schema version of the database or None if it does not
+		contain a data table yet."""
+		if not DatabaseSchema._havetable(db, "data"):
+			return None
+		if not DatabaseSchema._havetable(db, "metadata"):
+			return 1
+		row = db.execute("SELECT value FROM metadata WHERE key = 'dbversion';").fetchone()
+		if row is None:
+			return 1
+		return int(row[0])
+
+	@staticmethod
+	def getmetadata(db, key, default = None):
+		row = db.execute("SELECT value FROM metadata WHERE key = ?;", key).fetchone()
+		if row is None:
+			return default
+		return row[0]
+
+	@staticmethod
+	def setmetadata(db, key, value):
+		db.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?);", key, str(value))
+
+	@staticmethod
+	def _setversion(db, version):
+		DatabaseSchema.setmetadata(db, "dbversion", version)
+
+	@staticmethod
+	def _create_metadata(db):
+		db.execute("""CREATE TABLE IF NOT EXISTS metadata (
+			key character varying PRIMARY KEY,
+			value character varying NOT NULL
+		);""")
+
+	@staticmethod
+	def _create_data_v2(db):
+		db.execute("""CREATE TABLE data (
+			id integer PRIMARY KEY,
+			tfrom integer NOT NULL,
+			duration integer NOT NULL,
+			counts integer NOT NULL,
+			CHECK(duration > 0),
+			CHECK(counts >= 0)
+		);""")
+		db.execute("CREATE INDEX data_tfrom_idx ON data(tfrom);")
+
+	@staticmethod
+	def _create_data_v3(db):
+		db.execute("""CREATE TABLE data (
+			id integer PRIMARY KEY,
+			serial integer,
+			tfrom integer NOT NULL,
+			duration integer NOT NULL,
+			counts integer NOT NULL,
+			CHECK(duration > 0),
+			CHECK(counts >= 0)
+		);""")
+		db.execute("CREATE INDEX data_tfrom_idx ON data(tfrom);")
+		db.execute("CREATE INDEX data_serial_tfrom_idx ON data(serial, tfrom);")
+
+	@staticmethod
+	def _create_readouts(db):
+		db.execute("""CREATE TABLE readouts (
+			id integer PRIMARY KEY,
+			serial integer,
+			treadout integer NOT NULL,
+			tfirst integer,
+			tlast integer,
+			rows integer NOT NULL,
+			skipped integer NOT NULL
+		);""")
+		db.execute("CREATE INDEX readouts_serial_idx ON readouts(serial, treadout);")
+
+	@staticmethod
+	def _create_rtree(db):
+		"""Creates the interval index. Returns False if the SQLite library
+		lacks the R*Tree module."""
+		try:
+			db.execute("CREATE VIRTUAL TABLE data_rtree USING rtree(id, tfrom, tto, smin, smax);")
+		except sqlite3.OperationalError as e:
+			if "no such module" not in str(e):
+				raise
+			DatabaseSchema._log.warning("SQLite library has no R*Tree support, database will be created without interval index")
+			return False
+		db.execute("""CREATE TRIGGER data_rtree_insert AFTER INSERT ON data BEGIN
+			INSERT INTO data_rtree (id, tfrom, tto, smin, smax) VALUES (new.id, new.tfrom, new.tfrom + new.duration, coalesce(new.serial, -1), coalesce(new.serial, -1));
+		END;""")
+		db.execute("""CREATE TRIGGER data_rtree_update AFTER UPDATE OF serial, tfrom, duration ON data BEGIN
+			UPDATE data_rtree SET tfrom = new.tfrom, tto = new.tfrom + new.duration, smin = coalesce(new.serial, -1), smax = coalesce(new.serial, -1) WHERE id = new.id;
+		END;""")
+		db.execute("""CREATE TRIGGER data_rtree_delete AFTER DELETE ON data BEGIN
+			DELETE FROM data_rtree WHERE id = old.id;
+		END;""")
+		return True
+
+	@staticmethod
+	def hasrtree(db):
+		return DatabaseSchema._havetable(db, "data_rtree")
+
+	@staticmethod
+	def open(db):
+		"""Creates the current schema if the database is empty and returns the
+		schema version that the database uses."""
+		version = DatabaseSchema.getversion(db)
+		if version is None:
+			db.execute("BEGIN;")
+			DatabaseSchema._create_metadata(db)
+			DatabaseSchema._create_data_v3(db)
+			DatabaseSchema._create_readouts(db)
+			DatabaseSchema._create_rtree(db)
+			DatabaseSchema._setversion(db, DatabaseSchema.CURRENT_VERSION)
+			db.commit()
+			version = DatabaseSchema.CURRENT_VERSION
+		return version
+
+	@staticmethod
+	def _migrate_v1_v2(db):
+		db.execute("ALTER TABLE data RENAME TO data_v1;")
+		DatabaseSchema._create_data_v2(db)
+		db.execute("""INSERT INTO data (id, tfrom, duration, counts)
+			SELECT id, CAST(strftime('%s', tfrom) AS integer), CAST(strftime('%s', tto) AS integer) - CAST(strftime('%s', tfrom) AS integer), counts FROM data_v1;""")
+		db.execute("DROP TABLE data_v1;")
+
+	@staticmethod
+	def _migrate_v2_v3(db):
+		db.execute("ALTER TABLE data ADD COLUMN serial integer;")
+		db.execute("CREATE INDEX data_serial_tfrom_idx ON data(serial, tfrom);")
+		DatabaseSchema._create_readouts(db)
+
+	@staticmethod
+	def _migrate_v3_v4(db):
+		if DatabaseSchema._create_rtree(db):
+			db.execute("INSERT INTO data_rtree (id, tfrom, tto, smin, smax) SELECT id, tfrom, tfrom + duration, coalesce(serial, -1), coalesce(serial, -1) FROM data;")
+
+	@staticmethod
+	def migrate(db):
+		"""Migrates the database in place to the current schema version. Every
+		migration step runs in its own transaction."""
+		version = DatabaseSchema.getversion(db)
+		if version is None:
+			return DatabaseSchema.open(db)
+
+		migrations = {
+			1:	DatabaseSchema._migrate_v1_v2,
+			2:	DatabaseSchema._migrate_v2_v3,
+			3:	DatabaseSchema._migrate_v3_v4,
+		}
+		while version < DatabaseSchema.CURRENT_VERSION:
+			DatabaseSchema._log.info("Migrating database from schema version %d to %d" % (version, version + 1))
+			db.execute("BEGIN;")
+			DatabaseSchema._create_metadata(db)
+			migrations[version](db)
+			version += 1
+			DatabaseSchema._setversion(db, version)
+			db.commit()
+		return version
@@ -21,7 +21,10 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 #
 
+import os
 import sys
+import glob
+import heapq
 import datetime
 import logging
 import hashlib
@@ -38,8 +41,20 @@ from RS232Connection import RS232Connection
 from SimulatedConnection import SimulatedConnection
 from InvalidConnection import InvalidConnection
 from GSOnline import GSOnline
+from AsyncOutputBackend import AsyncOutputBackend
 from Exceptions import InvalidArgumentException
 from HexDump import HexDump
+from SQLite import SQLite
+from CompressedFile import CompressedFile
+from DatabaseSchema import DatabaseSchema
+from DatabaseCompactor import DatabaseCompactor
+from IntervalIndex import IntervalIndex
+from ColumnArchive import ColumnArchive, ColumnArchiveReader, ColumnArchiveException
+from OnlineRing import OnlineRingWriter
+from Journal import Journal, JournalReader, JournalException
+from LogSlicer import LogSlicer
+from ToolboxCSV import ToolboxCSV
+from DosisConversion import DosisConversion
 
 class GammaCommands():
 	def __init__(self, args):
@@ -52,6 +67,7 @@ class GammaCommands():
 		self._conn = None
 		self._device = None
 		self._logcache = None
+		self._serial = None
 
 	def connect(self):
 		if not self._args["nodevice"]:
@@ -66,14 +82,50 @@ class GammaCommands():
 			# Switch to a known mode state if possible
 			self._device.initmode()
 
-	def execute(self):
+	@staticmethod
+	def _logsource(command):
+		"""Returns (infilename, (outformat, aggregation, filename)) for commands that parse
+		the log (infilename is None when reading from the device) or None for
+		all other commands."""
+		if command.name == "readlog":
+			return (None, tuple(command.args))
+		elif command.name == "readbinlog":
+			return (command.args[0], tuple(command.args[1:]))
+		return None
+
+	def _schedule(self):
+		"""Yields (method, args) for every command. Runs of consecutive readlog
+		or readbinlog commands that read the same log are merged into a single
+		call of _readlog() so that the log is parsed only once and all outputs
+		are fed from that parse. With --nologcache, every command reads the
+		log again and nothing is merged."""
+		pending = None
 		for command in self._args.getcommands():
-			methodname = "_cmd_" + command.name
-			try:
-				method = getattr(self, methodname)
-			except AttributeError:
-				raise InvalidArgumentException("Programming error: no such method '%s' -- please notify %s!" % (methodname, Globals.AUTHOR_AND_EMAIL))
-			method(*command.args)
+			source = GammaCommands._logsource(command)
+			if (pending is not None) and (source is not None) and (source[0] == pending[0]) and (not self._args["nologcache"]):
+				pending[1].append(source[1])
+				continue
+
+			if pending is not None:
+				yield (self._readlog, pending)
+				pending = None
+
+			if source is not None:
+				pending = (source[0], [ source[1] ])
+			else:
+				methodname = "_cmd_" + command.name
+				try:
+					method = getattr(self, methodname)
+				except AttributeError:
+					raise InvalidArgumentException("Programming error: no such method '%s' -- please notify %s!" % (methodname, Globals.AUTHOR_AND_EMAIL))
+				yield (method, command.args)
+
+		if pending is not None:
+			yield (self._readlog, pending)
+
+	def execute(self):
+		for (method, args) in self._schedule():
+			method(*args)
 		self._device.close()
 
 	def _cmd_identify(self):
@@ -100,6 +152,39 @@ class GammaCommands():
 			raise InvalidArgumentException("format string for 'settime' command invalid: '%s'" % (date))
 		self._device.settime(date)
 
+	def _createbackend(self, outformat, filename, aggregation = None):
+		backendclass = OutputBackends.getbackendbyname(outformat)
+		if (outformat == "sqlite") and self._args["sqlite_shards"]:
+			backendclass = OutputBackends.OutputBackendSqliteShards
+		if self._args["async_output"] is None:
+			backend = backendclass(filename, self._args)
+		else:
+			backend = AsyncOutputBackend(lambda: backendclass(filename, self._args), policy = self._args["async_output"], queuesize = self._args["async_queue_size"])
+		if aggregation is not None:
+			backend = OutputBackends.OutputBackendAggregate(backend, aggregation)
+		return backend
+
+	@staticmethod
+	def _checkaggregation(outformat, aggregation):
+		if aggregation is None:
+			return
+		if aggregation not in OutputBackends.OutputBackendAggregate.aggregations:
+			raise InvalidArgumentException("Expected one of %s as aggregation, but '%s' given." % (", ".join(OutputBackends.OutputBackendAggregate.aggregations), aggregation))
+		if outformat in [ "bin", "store" ]:
+			raise InvalidArgumentException("The %s output backend writes the raw log and cannot be used with an aggregation." % (outformat))
+
+	def _getserial(self):
+		"""Returns the serial number of the device that the data comes from, as
+		given by --serial or as reported by the connected device. Returns None
+		if it is unknown."""
+		if self._args["serial"] is not None:
+			return self._args["serial"]
+		if self._args["nodevice"]:
+			return None
+		if self._serial is None:
+			self._serial = self._device.getversion().get("serial")
+		return self._serial
+
 	def _getrawlog(self, infilename):
 		if self._logcache is not None:
 			return self._logcache
@@ -115,14 +200,30 @@ class GammaCommands():
 			self._logcache = (logsize, logdata)
 		return (logsize, logdata)
 
-	def _cmd_readbinlog(self, infilename, outformat, filename):
-		accepted_formats = set([ "txt", "sqlite", "csv", "bin", "xml", "sql", "mysql" ])
-		if outformat not in accepted_formats:
-			raise InvalidArgumentException("'readlog' command expects one of %s as file format, but '%s' given." % (", ".join(sorted(list(accepted_formats))), outformat))
+	def _readlog(self, infilename, targets):
+		"""Parses the log once and writes it to all targets, which is a list of
+		(outformat, aggregation, filename) tuples."""
+		accepted_formats = set([ "txt", "sqlite", "csv", "bin", "xml", "sql", "mysql", "archive", "npz", "store", "influx", "journal" ])
+		for (outformat, aggregation, filename) in targets:
+			if outformat not in accepted_formats:
+				raise InvalidArgumentException("'readlog' command expects one of %s as file format, but '%s' given." % (", ".join(sorted(list(accepted_formats))), outformat))
+			GammaCommands._checkaggregation(outformat, aggregation)
 		(logsize, logdata) = self._getrawlog(infilename)
 
-		backendclass = OutputBackends.getbackendbyname(outformat)
-		backend = backendclass(filename, self._args)
+		backends = [ ]
+		try:
+			for (outformat, aggregation, filename) in targets:
+				backends.append(self._createbackend(outformat, filename, aggregation))
+		except:
+			OutputBackends.OutputBackendMulti(backends).close()
+			raise
+		if len(backends) == 1:
+			backend = backends[0]
+		else:
+			self._log.debug("Parsing log once for %d outputs" % (len(backends)))
+			backend = OutputBackends.OutputBackendMulti(backends)
+
+		backend.setserial(self._getserial() if (infilename is None) else self._args["serial"])
 		backend.initdata(logsize, logdata)
 		parserclass = {
 			"v1":		LogDataParserVers1,
@@ -131,8 +232,173 @@ class GammaCommands():
 		parserclass(logdata, backend).parse(logsize)
 		backend.close()
 
-	def _cmd_readlog(self, outformat, filename):
-		self._cmd_readbinlog(None, outformat, filename)
+	def _cmd_readbinlog(self, infilename, outformat, aggregation, filename):
+		self._readlog(infilename, [ (outformat, aggregation, filename) ])
+
+	def _cmd_readlog(self, outformat, aggregation, filename):
+		self._readlog(None, [ (outformat, aggregation, filename) ])
+
+	@staticmethod
+	def _archiveintervals(reader):
+		for (tfrom, duration, counts) in reader:
+			fromtime = DatabaseSchema.epoch_to_datetime(tfrom)
+			yield (fromtime, fromtime + datetime.timedelta(0, duration), counts)
+		reader.close()
+
+	def _readintervals(self, infilename):
+		"""Opens a file that was written by one of the interval-based output
+		backends and returns an iterator over (fromtime, totime, counts) of
+		every stored interval."""
+		if ColumnArchive.isarchive(infilename):
+			try:
+				return GammaCommands._archiveintervals(ColumnArchiveReader(infilename))
+			except ColumnArchiveException as e:
+				raise InvalidArgumentException(str(e))
+		elif Journal.isjournal(infilename):
+			try:
+				return GammaCommands._archiveintervals(JournalReader(infilename))
+			except JournalException as e:
+				raise InvalidArgumentException(str(e))
+		elif infilename.lower().endswith(".npz"):
+			return OutputBackends.OutputBackendNPZ.readdata(infilename)
+		raise InvalidArgumentException("'%s' is not in a format that can be read back (supported are archive, journal and npz files)." % (infilename))
+
+	def _binintervals(self, infilename):
+		"""Yields the intervals of a binary log in log order, which is
+		chronological. The file is only read once the first interval is
+		requested."""
+		(logsize, logdata) = OutputBackends.OutputBackendBIN.readdata(infilename, self._args["force"])
+		parserclass = {
+			"v1":		LogDataParserVers1,
+			"v2":		LogDataParserVers2,
+		}[self._args["protocol"]]
+		yield from parserclass(logdata, None).intervals(logsize)
+
+	def _exportintervals(self, infilename):
+		"""Like _readintervals(), but also reads back CSV, TXT and binary
+		exports (which may be compressed)."""
+		name = infilename.lower()
+		if CompressedFile.compression(name) is not None:
+			name = os.path.splitext(name)[0]
+		if name.endswith(".csv"):
+			if ToolboxCSV.isexport(infilename):
+				return ToolboxCSV.readdata(infilename)
+			return OutputBackends.OutputBackendCSV.readdata(infilename, self._args["date_format"])
+		elif name.endswith(".txt"):
+			return OutputBackends.OutputBackendTXT.readdata(infilename, self._args["date_format"])
+		elif name.endswith(".bin") or name.endswith(".manifest"):
+			return self._binintervals(infilename)
+		return self._readintervals(infilename)
+
+	@staticmethod
+	def _expandfilenames(infiles):
+		"""Expands a comma separated list of filenames or glob patterns."""
+		infilenames = [ ]
+		for pattern in infiles.split(","):
+			matches = sorted(glob.glob(pattern))
+			if len(matches) == 0:
+				raise InvalidArgumentException("'%s' does not match any file." % (pattern))
+			infilenames += matches
+		return infilenames
+
+	def _cmd_merge(self, infiles, outformat, aggregation, filename):
+		accepted_formats = set([ "txt", "sqlite", "csv", "xml", "sql", "mysql", "archive", "npz", "influx", "journal" ])
+		if outformat not in accepted_formats:
+			raise InvalidArgumentException("'merge' command expects one of %s as file format, but '%s' given." % (", ".join(sorted(list(accepted_formats))), outformat))
+		GammaCommands._checkaggregation(outformat, aggregation)
+
+		infilenames = GammaCommands._expandfilenames(infiles)
+		sources = [ self._exportintervals(infilename) for infilename in infilenames ]
+
+		# Every source is sorted by time already, so a heap merge keeps only
+		# one interval per source in memory. Intervals that start before the
+		# end of the last written one are duplicates from overlapping exports
+		backend = self._createbackend(outformat, filename, aggregation)
+		backend.setserial(self._args["serial"])
+		(written, dropped, coveredto) = (0, 0, None)
+		try:
+			for (fromtime, totime, counts) in heapq.merge(*sources):
+				if (coveredto is not None) and (fromtime < coveredto):
+					dropped += 1
+					continue
+				backend.newinterval(fromtime, totime, counts)
+				coveredto = totime
+				written += 1
+		finally:
+			backend.close()
+		self._log.info("Merged %d files into %d intervals, dropped %d duplicate or overlapping intervals" % (len(infilenames), written, dropped))
+
+	def _cmd_importcsv(self, infiles, outformat, aggregation, filename):
+		accepted_formats = set([ "txt", "sqlite", "csv", "xml", "sql", "mysql", "archive", "npz", "influx", "journal" ])
+		if outformat not in accepted_formats:
+			raise InvalidArgumentException("'importcsv' command expects one of %s as file format, but '%s' given." % (", ".join(sorted(list(accepted_formats))), outformat))
+		GammaCommands._checkaggregation(outformat, aggregation)
+
+		infilenames = GammaCommands._expandfilenames(infiles)
+		for infilename in infilenames:
+			if not ToolboxCSV.isexport(infilename):
+				raise InvalidArgumentException("'%s' is not a Gamma Scout Toolbox CSV export." % (infilename))
+
+		backend = self._createbackend(outformat, filename, aggregation)
+		backend.setserial(self._args["serial"])
+		rowcount = 0
+		try:
+			for infilename in infilenames:
+				for (fromtime, totime, counts) in ToolboxCSV.readdata(infilename):
+					backend.newinterval(fromtime, totime, counts)
+					rowcount += 1
+		finally:
+			backend.close()
+		self._log.info("Imported %d intervals from %d files" % (rowcount, len(infilenames)))
+
+	def _cmd_convert(self, infilename, outformat, aggregation, filename):
+		accepted_formats = set([ "txt", "sqlite", "csv", "xml", "sql", "mysql", "archive", "npz", "influx", "journal" ])
+		if outformat not in accepted_formats:
+			raise InvalidArgumentException("'convert' command expects one of %s as file format, but '%s' given." % (", ".join(sorted(list(accepted_formats))), outformat))
+		GammaCommands._checkaggregation(outformat, aggregation)
+
+		intervals = self._readintervals(infilename)
+		backend = self._createbackend(outformat, filename, aggregation)
+		backend.setserial(self._args["serial"])
+		for (fromtime, totime, counts) in intervals:
+			backend.newinterval(fromtime, totime, counts)
+		backend.close()
+
+	@staticmethod
+	def _parsetimearg(command, value):
+		for fmt in [ "%Y-%m-%d-%H-%M-%S", "%Y-%m-%d" ]:
+			try:
+				return datetime.datetime.strptime(value, fmt)
+			except ValueError:
+				pass
+		raise InvalidArgumentException("'%s' command expects times as YYYY-MM-DD-HH-MM-SS or YYYY-MM-DD, but '%s' given." % (command, value))
+
+	def _cmd_slice(self, infilename, fromtime, totime, filename):
+		fromtime = GammaCommands._parsetimearg("slice", fromtime)
+		totime = GammaCommands._parsetimearg("slice", totime)
+		slicer = LogSlicer(infilename, self._args["date_format"])
+		try:
+			data = slicer.getrange(fromtime, totime)
+			try:
+				if filename == "-":
+					outfile = sys.stdout.buffer
+				else:
+					outfile = CompressedFile.open(OutputBackends._strftimeexpand(filename, self._args), "wb", level = self._args["compress_level"], threaded = self._args["compress_thread"])
+				try:
+					if not self._args["noheader"]:
+						outfile.write(slicer.header)
+					outfile.write(data)
+				finally:
+					if filename == "-":
+						outfile.flush()
+					else:
+						outfile.close()
+				self._log.info("Extracted %d bytes from '%s'" % (len(data), infilename))
+			finally:
+				# The mapping cannot be closed while the view is exported
+				data.release()
+		finally:
+			slicer.close()
 
 	def _cmd_clearlog(self):
 		self._device.clearlog()
@@ -151,29 +417,97 @@ class GammaCommands():
 
 	def _cmd_online(self, interval, outformat, filename):
 		interval = int(interval)
-		accepted_formats = set([ "txt", "csv", "sql" ])
+		accepted_formats = set([ "txt", "csv", "sql", "sqlite", "influx", "journal" ])
 		if outformat not in accepted_formats:
 			raise InvalidArgumentException("'online' command expects one of %s as file format, but '%s' given." % (", ".join(sorted(list(accepted_formats))), outformat))
 		if not GSOnline.intervaltime_possible(interval):
 			raise InvalidArgumentException("'online' command does not support interval of %d seconds, valid choices are %s." % (interval, GSOnline.possible_interval_str()))
 
+		if (self._args["ringbuffer"] is not None) and (self._args["ringbuffer_size"] < 1):
+			raise InvalidArgumentException("Ring buffer must hold at least one reading, but %d given." % (self._args["ringbuffer_size"]))
+
 		intervalcode = GSOnline.intervaltime_to_cmd(interval)
-		backendclass = OutputBackends.getbackendbyname(outformat)
-		backend = backendclass(filename, self._args)
+		backend = self._createbackend(outformat, filename)
+		backend.setserial(self._getserial())
+		ring = None
+		if self._args["ringbuffer"] is not None:
+			ring = OnlineRingWriter(self._args["ringbuffer"], self._args["ringbuffer_size"])
 
 		self._device.setonlineinterval(intervalcode)
-		while True:
-			reading = self._device.readonlinevalue()
-			if reading is None:
-				continue
+		try:
+			while True:
+				reading = self._device.readonlinevalue()
+				if reading is None:
+					continue
+
+				fromts = reading.utctimestamp - datetime.timedelta(0, reading.interval)
+				backend.newinterval(fromts, reading.utctimestamp, reading.counts)
+				backend.flush()
+				if ring is not None:
+					ring.append(reading.utctimestamp, reading.interval, reading.counts, DosisConversion.cts_per_sec_to_usv_per_hr(reading.counts / reading.interval) if (reading.interval > 0) else 0)
+
+				if reading.interval != interval:
+					# Gamma Scout decided to switch intervals on its own, bring it
+					# back on track
+					self._device.setonlineinterval(intervalcode)
+		finally:
+			# Online mode is usually ended by a KeyboardInterrupt; make sure
+			# buffered data of the backend still ends up on disk
+			if ring is not None:
+				ring.close()
+			backend.close()
+
+	def _cmd_migratedb(self, filename):
+		db = SQLite(filename)
+		oldversion = DatabaseSchema.getversion(db)
+		if oldversion is None:
+			raise InvalidArgumentException("'%s' does not contain any Gamma Scout data, refusing to migrate it." % (filename))
+		if oldversion > DatabaseSchema.CURRENT_VERSION:
+			raise InvalidArgumentException("'%s' uses schema version %d, but only versions up to %d are supported." % (filename, oldversion, DatabaseSchema.CURRENT_VERSION))
+		newversion = DatabaseSchema.migrate(db)
+		db.close()
+		self._log.info("Migrated %s from schema version %d to %d" % (filename, oldversion, newversion))
+
+	def _cmd_compact(self, filename):
+		db = SQLite(filename, timeout = self._args["sqlite_busy_timeout"], busyretries = 5)
+		version = DatabaseSchema.getversion(db)
+		if version is None:
+			raise InvalidArgumentException("'%s' does not contain any Gamma Scout data, refusing to compact it." % (filename))
+		if version < 3:
+			raise InvalidArgumentException("'%s' uses schema version %d, but compaction requires version 3 or later. Use the 'migratedb' command first." % (filename, version))
+
+		compactor = DatabaseCompactor(db)
+		if self._args["compact_hourly_after"] > 0:
+			compactor.addstage("hourly", 3600, self._args["compact_hourly_after"] * 86400)
+		if self._args["compact_daily_after"] > 0:
+			compactor.addstage("daily", 86400, self._args["compact_daily_after"] * 86400)
+		compactor.compact()
+		db.close()
+
+	def _openintervalindex(self, filename):
+		db = SQLite(filename, timeout = self._args["sqlite_busy_timeout"], busyretries = 5)
+		if DatabaseSchema.getversion(db) is None:
+			raise InvalidArgumentException("'%s' does not contain any Gamma Scout data." % (filename))
+		return IntervalIndex(db)
+
+	@staticmethod
+	def _serialstr(serial):
+		return "unknown device" if (serial is None) else "device %d" % (serial)
 
-			fromts = reading.utctimestamp - datetime.timedelta(0, reading.interval)
-			backend.newinterval(fromts, reading.utctimestamp, reading.counts)
+	def _cmd_gaps(self, filename):
+		(count, total) = (0, 0)
+		for (serial, gapfrom, gapto) in self._openintervalindex(filename).gaps(self._args["min_gap"]):
+			print("%s: gap of %d seconds from %s to %s" % (GammaCommands._serialstr(serial), gapto - gapfrom, DatabaseSchema.epoch_to_datetime(gapfrom), DatabaseSchema.epoch_to_datetime(gapto)))
+			count += 1
+			total += gapto - gapfrom
+		print("%d gaps, %d seconds in total" % (count, total))
 
-			if reading.interval != interval:
-				# Gamma Scout decided to switch intervals on its own, bring it
-				# back on track
-				self._device.setonlineinterval(intervalcode)
+	def _cmd_overlaps(self, filename):
+		count = 0
+		for (serial, (id1, tfrom1, tto1), (id2, tfrom2, tto2)) in self._openintervalindex(filename).overlaps():
+			print("%s: interval %d (%s to %s) overlaps interval %d (%s to %s)" % (GammaCommands._serialstr(serial), id1, DatabaseSchema.epoch_to_datetime(tfrom1), DatabaseSchema.epoch_to_datetime(tto1), id2, DatabaseSchema.epoch_to_datetime(tfrom2), DatabaseSchema.epoch_to_datetime(tto2)))
+			count += 1
+		print("%d overlapping pairs of intervals" % (count))
 
 	def _cmd_switchmode(self, mode):
 		mode = mode.lower()
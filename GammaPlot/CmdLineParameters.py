@@ -1,5 +1,5 @@
 from CmdLineParser import CmdLineParser, CmdLineOption
-from CmdLineParser import ExtendedDateTimeParser, TimeIntervalParser, EnumParser
+from CmdLineParser import ExtendedDateTimeParser, TimeIntervalParser, EnumParser, IntParser
 
 class CmdLineParameters():
 	def __init__(self):
@@ -13,10 +13,14 @@ class CmdLineParameters():
 		o.setminmaxoccurence(0, 1).settakesparameters(True, "datetime").setparser(ExtendedDateTimeParser()).setdefaultvalue("now")
 		self._cmdline.addoption(o)
 
-		o = CmdLineOption("dbfile", "d", "dbfile").setdescription("The filename of the Sqlite3 database which stores the acquired data.")
+		o = CmdLineOption("dbfile", "d", "dbfile").setdescription("The filename of the Sqlite3 database (or of a file written by the archive or npz output backend) which stores the acquired data. For databases that were split into shards with --sqlite-shards, give the same strftime pattern that was used for writing.")
 		o.setminmaxoccurence(0, 1).settakesparameters(True, "filename").setdefaultvalue("gammascout.sqlite")
 		self._cmdline.addoption(o)
 
+		o = CmdLineOption("serial", "n", "serial").setdescription("Only plot the data of the device with this serial number. By default, the data of all devices is used.")
+		o.setminmaxoccurence(0, 1).settakesparameters(True, "number").setparser(IntParser(0, None))
+		self._cmdline.addoption(o)
+
 		o = CmdLineOption("avgline", "a", "avgline").setdescription("Draw a plot average line which averages the described timeinterval. May be specified multiple times in order to get multiple average lines.")
 		o.setminmaxoccurence(0, None).settakesparameters(True, "interval").setparser(TimeIntervalParser())
 		self._cmdline.addoption(o)
@@ -0,0 +1,199 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import zlib
+import struct
+import bisect
+
+class ColumnArchiveException(Exception):
+	pass
+
+class ColumnArchive():
+	"""Compact columnar archive of intervals. Intervals are collected in
+	blocks of a fixed number of rows; each block stores its columns (start
+	time as delta to the previous row, duration and counts) one after another
+	and is compressed with zlib. An index at the end of the file holds offset,
+	size, row count and the covered time range of every block, so that a time
+	range can be read by decompressing only the blocks that overlap it.
+
+	File layout (all integers little endian):
+		header:		magic "GSCA", u16 version, u32 rows per block
+		blocks:		zlib(s64 tfrom deltas[n], u32 durations[n], u32 counts[n])
+		index:		per block u64 offset, u32 size, u32 rows, s64 mintime, s64 maxtime
+		trailer:	u64 index offset, u32 block count, magic "GSCA"
+
+	All times are integer seconds since the epoch (UTC); mintime is the
+	smallest start time and maxtime the largest end time within a block."""
+	MAGIC = b"GSCA"
+	VERSION = 1
+
+	_header = struct.Struct("< 4s H I")
+	_indexentry = struct.Struct("< Q I I q q")
+	_trailer = struct.Struct("< Q I 4s")
+
+	@staticmethod
+	def isarchive(filename):
+		try:
+			with open(filename, "rb") as f:
+				return f.read(len(ColumnArchive.MAGIC)) == ColumnArchive.MAGIC
+		except IOError:
+			return False
+
+
+class ColumnArchiveWriter():
+	def __init__(self, filename, blocksize = 4096, level = 9):
+		assert(blocksize > 0)
+		self._f = open(filename, "wb")
+		self._blocksize = blocksize
+		self._level = level
+		self._index = [ ]
+		self._tfrom = [ ]
+		self._duration = [ ]
+		self._counts = [ ]
+		self._f.write(ColumnArchive._header.pack(ColumnArchive.MAGIC, ColumnArchive.VERSION, blocksize))
+
+	def append(self, tfrom, duration, counts):
+		self._tfrom.append(tfrom)
+		self._duration.append(duration)
+		self._counts.append(counts)
+		if len(self._tfrom) >= self._blocksize:
+			self._flushblock()
+
+	def _flushblock(self):
+		rows = len(self._tfrom)
+		if rows == 0:
+			return
+
+		# First delta is relative to zero, i.e. the absolute time
+		deltas = [ self._tfrom[0] ] + [ self._tfrom[i] - self._tfrom[i - 1] for i in range(1, rows) ]
+		payload = struct.pack("< %dq %dI %dI" % (rows, rows, rows), *(deltas + self._duration + self._counts))
+		payload = zlib.compress(payload, self._level)
+
+		mintime = min(self._tfrom)
+		maxtime = max(tfrom + duration for (tfrom, duration) in zip(self._tfrom, self._duration))
+		self._index.append((self._f.tell(), len(payload), rows, mintime, maxtime))
+		self._f.write(payload)
+		(self._tfrom, self._duration, self._counts) = ([ ], [ ], [ ])
+
+	def close(self):
+		self._flushblock()
+		indexoffset = self._f.tell()
+		for entry in self._index:
+			self._f.write(ColumnArchive._indexentry.pack(*entry))
+		self._f.write(ColumnArchive._trailer.pack(indexoffset, len(self._index), ColumnArchive.MAGIC))
+		self._f.close()
+
+
+class ColumnArchiveReader():
+	def __init__(self, filename):
+		self._f = open(filename, "rb")
+		header = self._f.read(ColumnArchive._header.size)
+		if len(header) != ColumnArchive._header.size:
+			raise ColumnArchiveException("'%s' is too short to be an archive." % (filename))
+		(magic, version, self._blocksize) = ColumnArchive._header.unpack(header)
+		if magic != ColumnArchive.MAGIC:
+			raise ColumnArchiveException("'%s' is not an archive (wrong magic)." % (filename))
+		if version != ColumnArchive.VERSION:
+			raise ColumnArchiveException("'%s' has archive version %d, only version %d is supported." % (filename, version, ColumnArchive.VERSION))
+
+		self._f.seek(-ColumnArchive._trailer.size, 2)
+		(indexoffset, blockcount, magic) = ColumnArchive._trailer.unpack(self._f.read(ColumnArchive._trailer.size))
+		if magic != ColumnArchive.MAGIC:
+			raise ColumnArchiveException("'%s' is truncated (no archive index found)." % (filename))
+		self._f.seek(indexoffset)
+		indexdata = self._f.read(blockcount * ColumnArchive._indexentry.size)
+		self._index = [ ColumnArchive._indexentry.unpack_from(indexdata, i * ColumnArchive._indexentry.size) for i in range(blockcount) ]
+
+		# Blocks are usually in chronological order; if they are, the first
+		# relevant block can be found by bisection
+		self._ordered = all(self._index[i - 1][3] <= self._index[i][3] for i in range(1, len(self._index)))
+		self._maxtimes = [ ]
+		maxtime = None
+		for entry in self._index:
+			maxtime = entry[4] if (maxtime is None) else max(maxtime, entry[4])
+			self._maxtimes.append(maxtime)
+
+	def __len__(self):
+		return sum(entry[2] for entry in self._index)
+
+	def timerange(self):
+		"""Returns (mintime, maxtime) of all stored intervals or None if the
+		archive is empty."""
+		if len(self._index) == 0:
+			return None
+		return (min(entry[3] for entry in self._index), self._maxtimes[-1])
+
+	def _readblock(self, entry):
+		(offset, size, rows, mintime, maxtime) = entry
+		self._f.seek(offset)
+		payload = zlib.decompress(self._f.read(size))
+		values = struct.unpack("< %dq %dI %dI" % (rows, rows, rows), payload)
+		tfrom = [ ]
+		t = 0
+		for delta in values[0 : rows]:
+			t += delta
+			tfrom.append(t)
+		return (tfrom, values[rows : 2 * rows], values[2 * rows : 3 * rows])
+
+	def _candidates(self, fromtime):
+		if (fromtime is None) or (not self._ordered):
+			return self._index
+		# Skip all blocks which end before fromtime
+		return self._index[bisect.bisect_right(self._maxtimes, fromtime):]
+
+	def read(self, fromtime = None, totime = None):
+		"""Returns the columns (tfrom, duration, counts) of all intervals with
+		fromtime <= tfrom < totime as three lists. Either limit may be None."""
+		(tfroms, durations, counts) = ([ ], [ ], [ ])
+		for entry in self._candidates(fromtime):
+			(mintime, maxtime) = (entry[3], entry[4])
+			if (totime is not None) and (mintime >= totime):
+				if self._ordered:
+					break
+				continue
+			if (fromtime is not None) and (maxtime <= fromtime):
+				continue
+
+			(blocktfrom, blockduration, blockcounts) = self._readblock(entry)
+			if ((fromtime is None) or (mintime >= fromtime)) and ((totime is None) or (maxtime <= totime)):
+				# Block lies completely within the requested range
+				tfroms += blocktfrom
+				durations += blockduration
+				counts += blockcounts
+			else:
+				for i in range(len(blocktfrom)):
+					if ((fromtime is None) or (blocktfrom[i] >= fromtime)) and ((totime is None) or (blocktfrom[i] < totime)):
+						tfroms.append(blocktfrom[i])
+						durations.append(blockduration[i])
+						counts.append(blockcounts[i])
+		return (tfroms, durations, counts)
+
+	def __iter__(self):
+		"""Iterates over all intervals as (tfrom, duration, counts) tuples."""
+		for entry in self._index:
+			for row in zip(*self._readblock(entry)):
+				yield row
+
+	def close(self):
+		self._f.close()
+
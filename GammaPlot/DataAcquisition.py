@@ -24,12 +24,17 @@
 
 import sys
 import time
+import functools
+import struct
+import zipfile
 import datetime
 import itertools
 import numpy
 import matplotlib
 
 from SQLite import SQLite
+from ColumnArchive import ColumnArchiveReader
+from ShardRouter import ShardRouter
 from DateTimeUtil import DateTimeUtil
 from StopWatch import StopWatch
 
@@ -60,16 +65,169 @@ class DatabaseDataSource(DataSource):
 		assert(isinstance(totimestamp, datetime.datetime))
 
 		t = StopWatch("DataBaseDataSource SQL query")
-		db = SQLite(self._parameters["dbfile"] or "gammascout.sqlite")
-		points = db.execute("SELECT tfrom, tto, counts FROM data WHERE (tfrom >= ?) AND (tfrom < ?) ORDER BY tfrom ASC;", fromtimestamp, totimestamp).fetchall()
-		if len(points) == 0:
+		dbfile = self._parameters["dbfile"] or "gammascout.sqlite"
+		if ShardRouter.issharded(dbfile):
+			# Database was written with --sqlite-shards, the filename is a
+			# strftime pattern
+			points = ShardRouter(dbfile).query(functools.partial(_queryshard, serial = self._parameters["serial"]), fromtimestamp, totimestamp)
+			xfrom = [ x for (x, y, z) in points ]
+			xto = [ y for (x, y, z) in points ]
+			cts = [ z for (x, y, z) in points ]
+		else:
+			(xfrom, xto, cts) = DatabaseDataSource.query(dbfile, fromtimestamp, totimestamp, self._parameters["serial"])
+		if len(cts) == 0:
 			print("Data acquisition returned no points to plotting.")
 			sys.exit(1)
+		t.finish()
+		return (xfrom, xto, cts)
+
+	@staticmethod
+	def query(dbfile, fromtimestamp, totimestamp, serial = None):
+		"""Returns the intervals of all devices or, if serial is given, of only
+		that device (requires a database of schema version 3)."""
+		db = SQLite(dbfile, timeout = 30, busyretries = 5)
+		dbversion = DatabaseDataSource._getdbversion(db)
+		if (serial is not None) and (dbversion < 3):
+			print("Database %s does not store device serial numbers, cannot select by serial number." % (dbfile))
+			sys.exit(1)
+		if dbversion == 1:
+			result = DatabaseDataSource._get_v1(db, fromtimestamp, totimestamp)
+		else:
+			result = DatabaseDataSource._get_v2(db, fromtimestamp, totimestamp, serial)
+		db.close()
+		return result
+
+	@staticmethod
+	def _getdbversion(db):
+		if db.execute("SELECT name FROM sqlite_master WHERE (type = 'table') AND (name = 'metadata');").fetchone() is None:
+			return 1
+		row = db.execute("SELECT value FROM metadata WHERE key = 'dbversion';").fetchone()
+		if row is None:
+			return 1
+		return int(row[0])
+
+	@staticmethod
+	def _get_v1(db, fromtimestamp, totimestamp):
+		points = db.execute("SELECT tfrom, tto, counts FROM data WHERE (tfrom >= ?) AND (tfrom < ?) ORDER BY tfrom ASC;", fromtimestamp, totimestamp).fetchall()
 
 		# Parse "from" and "to" from strings to datetime.datetime objects
 		xfrom = [ datetime.datetime.strptime(x, "%Y-%m-%d %H:%M:%S") for (x, y, z) in points ]
 		xto = [ datetime.datetime.strptime(y, "%Y-%m-%d %H:%M:%S") for (x, y, z) in points ]
 		cts = [ z for (x, y, z) in points ]
+		return (xfrom, xto, cts)
+
+	@staticmethod
+	def _get_v2(db, fromtimestamp, totimestamp, serial = None):
+		# Timestamps are stored as integer UTC epoch values, so the index on
+		# tfrom (or on serial and tfrom) can be used and no string parsing is
+		# necessary
+		fromepoch = DateTimeUtil.datetimeutc_to_timet(fromtimestamp)
+		toepoch = DateTimeUtil.datetimeutc_to_timet(totimestamp)
+		if serial is None:
+			points = db.execute("SELECT tfrom, duration, counts FROM data WHERE (tfrom >= ?) AND (tfrom < ?) ORDER BY tfrom ASC;", fromepoch, toepoch).fetchall()
+		else:
+			points = db.execute("SELECT tfrom, duration, counts FROM data WHERE (serial = ?) AND (tfrom >= ?) AND (tfrom < ?) ORDER BY tfrom ASC;", serial, fromepoch, toepoch).fetchall()
+
+		epoch = datetime.datetime(1970, 1, 1)
+		(xfrom, xto, cts) = ([ ], [ ], [ ])
+		for (tfrom, duration, counts) in points:
+			fromts = epoch + datetime.timedelta(0, tfrom)
+			xfrom.append(fromts)
+			xto.append(fromts + datetime.timedelta(0, duration))
+			cts.append(counts)
+		return (xfrom, xto, cts)
+
+def _queryshard(dbfile, fromtimestamp, totimestamp, serial = None):
+	# Runs in a worker process of the ShardRouter
+	(xfrom, xto, cts) = DatabaseDataSource.query(dbfile, fromtimestamp, totimestamp, serial)
+	return list(zip(xfrom, xto, cts))
+
+class ArchiveDataSource(DataSource):
+	def __init__(self, parameters):
+		DataSource.__init__(self)
+		self._parameters = parameters
+
+	def get(self, fromtimestamp, totimestamp):
+		assert(isinstance(fromtimestamp, datetime.datetime))
+		assert(isinstance(totimestamp, datetime.datetime))
+
+		t = StopWatch("ArchiveDataSource read")
+		reader = ColumnArchiveReader(self._parameters["dbfile"])
+		(tfroms, durations, counts) = reader.read(DateTimeUtil.datetimeutc_to_timet(fromtimestamp), DateTimeUtil.datetimeutc_to_timet(totimestamp))
+		reader.close()
+		if len(counts) == 0:
+			print("Data acquisition returned no points to plotting.")
+			sys.exit(1)
+
+		epoch = datetime.datetime(1970, 1, 1)
+		xfrom = [ epoch + datetime.timedelta(0, tfrom) for tfrom in tfroms ]
+		xto = [ fromts + datetime.timedelta(0, duration) for (fromts, duration) in zip(xfrom, durations) ]
+		t.finish()
+		return (xfrom, xto, list(counts))
+
+class NpzDataSource(DataSource):
+	"""Reads .npz files written by the npz output backend. Their members are
+	stored uncompressed, so every array is memory-mapped directly from the
+	file instead of being read into memory."""
+	def __init__(self, parameters):
+		DataSource.__init__(self)
+		self._parameters = parameters
+
+	@staticmethod
+	def _memmapmember(filename, zipinfo):
+		with open(filename, "rb") as f:
+			# The local file header has a fixed size of 30 bytes and is followed
+			# by filename and extra field, whose lengths may differ from the
+			# ones in the central directory
+			f.seek(zipinfo.header_offset)
+			header = f.read(30)
+			(namelen, extralen) = struct.unpack("< H H", header[26:30])
+			f.seek(zipinfo.header_offset + 30 + namelen + extralen)
+			version = numpy.lib.format.read_magic(f)
+			if version == (1, 0):
+				(shape, fortran_order, dtype) = numpy.lib.format.read_array_header_1_0(f)
+			else:
+				(shape, fortran_order, dtype) = numpy.lib.format.read_array_header_2_0(f)
+			offset = f.tell()
+		if len(shape) == 0 or shape[0] == 0:
+			return numpy.empty(shape, dtype = dtype)
+		return numpy.memmap(filename, dtype = dtype, mode = "r", offset = offset, shape = shape, order = "F" if fortran_order else "C")
+
+	@staticmethod
+	def load(filename):
+		"""Returns a dictionary of all arrays in the file. Stored members are
+		memory-mapped, compressed ones have to be read into memory."""
+		arrays = { }
+		with zipfile.ZipFile(filename) as npz:
+			for zipinfo in npz.infolist():
+				name = zipinfo.filename
+				if name.endswith(".npy"):
+					name = name[:-4]
+				if zipinfo.compress_type == zipfile.ZIP_STORED:
+					arrays[name] = NpzDataSource._memmapmember(filename, zipinfo)
+				else:
+					with npz.open(zipinfo) as f:
+						arrays[name] = numpy.lib.format.read_array(f)
+		return arrays
+
+	def get(self, fromtimestamp, totimestamp):
+		assert(isinstance(fromtimestamp, datetime.datetime))
+		assert(isinstance(totimestamp, datetime.datetime))
+
+		t = StopWatch("NpzDataSource read")
+		arrays = NpzDataSource.load(self._parameters["dbfile"])
+		tfrom = arrays["tfrom"].astype(numpy.int64)
+		selected = (tfrom >= DateTimeUtil.datetimeutc_to_timet(fromtimestamp)) & (tfrom < DateTimeUtil.datetimeutc_to_timet(totimestamp))
+		tfroms = tfrom[selected].tolist()
+		durations = arrays["duration"][selected].tolist()
+		cts = arrays["counts"][selected].tolist()
+		if len(cts) == 0:
+			print("Data acquisition returned no points to plotting.")
+			sys.exit(1)
+
+		epoch = datetime.datetime(1970, 1, 1)
+		xfrom = [ epoch + datetime.timedelta(0, tfrom) for tfrom in tfroms ]
+		xto = [ fromts + datetime.timedelta(0, duration) for (fromts, duration) in zip(xfrom, durations) ]
 		t.finish()
 		return (xfrom, xto, cts)
 
@@ -0,0 +1,122 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import os
+import re
+import heapq
+import datetime
+import concurrent.futures
+
+class ShardRouter():
+	"""Routes range queries to the database shards that were written by the
+	sqlite output backend with --sqlite-shards. The shard filenames are
+	derived from the strftime pattern and the queried time range; every shard
+	is queried in its own process and the (time ordered) results are merged."""
+	_DIRECTIVE = re.compile("%[-_0^#]*[EO]?(.)")
+
+	# Directives that change within the respective unit; everything that is
+	# not listed (like %H, %M or %c) is treated as hourly, which is the finest
+	# granularity of shards. Week based directives are treated as daily.
+	_GRANULARITY = { }
+	_GRANULARITY.update({ directive: "day" for directive in "aAdejuwxDFUWVGg" })
+	_GRANULARITY.update({ directive: "month" for directive in "bBhm" })
+	_GRANULARITY.update({ directive: "year" for directive in "CyY%" })
+	_UNITS = [ "hour", "day", "month", "year" ]
+
+	def __init__(self, pattern, maxworkers = None):
+		self._pattern = pattern
+		self._maxworkers = maxworkers
+		self._unit = ShardRouter.granularity(pattern)
+
+	@staticmethod
+	def issharded(filename):
+		return "%" in filename.replace("%%", "")
+
+	@staticmethod
+	def granularity(pattern):
+		"""Returns the coarsest unit ("hour", "day", "month" or "year") in
+		which the expansion of the pattern does not change."""
+		units = [ ShardRouter._GRANULARITY.get(directive, "hour") for directive in ShardRouter._DIRECTIVE.findall(pattern) ]
+		return min(units + [ "year" ], key = ShardRouter._UNITS.index)
+
+	def _steps(self, fromtimestamp, totimestamp):
+		"""Yields the start of every unit that intersects the time range."""
+		if self._unit == "hour":
+			timestamp = fromtimestamp.replace(minute = 0, second = 0, microsecond = 0)
+		elif self._unit == "day":
+			timestamp = fromtimestamp.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+		elif self._unit == "month":
+			timestamp = fromtimestamp.replace(day = 1, hour = 0, minute = 0, second = 0, microsecond = 0)
+		else:
+			timestamp = fromtimestamp.replace(month = 1, day = 1, hour = 0, minute = 0, second = 0, microsecond = 0)
+		while timestamp < totimestamp:
+			yield timestamp
+			if self._unit == "hour":
+				timestamp += datetime.timedelta(0, 3600)
+			elif self._unit == "day":
+				timestamp += datetime.timedelta(1)
+			elif self._unit == "month":
+				if timestamp.month == 12:
+					timestamp = timestamp.replace(year = timestamp.year + 1, month = 1)
+				else:
+					timestamp = timestamp.replace(month = timestamp.month + 1)
+			else:
+				timestamp = timestamp.replace(year = timestamp.year + 1)
+
+	def getshards(self, fromtimestamp, totimestamp):
+		"""Returns the filenames of all existing shards that may contain
+		intervals starting within the time range, in chronological order. The
+		pattern is expanded once per hour, day, month or year, depending on
+		the finest strftime directive that it contains."""
+		shards = [ ]
+		for timestamp in self._steps(fromtimestamp, totimestamp):
+			filename = timestamp.strftime(self._pattern)
+			if (len(shards) == 0) or (shards[-1] != filename):
+				shards.append(filename)
+
+		# Patterns in which the time is not monotonic (e.g. "%m-%Y") could
+		# produce the same name twice in non-adjacent places
+		seen = set()
+		unique = [ ]
+		for filename in shards:
+			if (filename not in seen) and os.path.isfile(filename):
+				seen.add(filename)
+				unique.append(filename)
+		return unique
+
+	def query(self, function, fromtimestamp, totimestamp):
+		"""Calls function(shardfilename, fromtimestamp, totimestamp) for every
+		relevant shard, which must return a time ordered list of tuples, and
+		returns all tuples merged in time order. function must be defined at
+		module level so that it can be called in worker processes."""
+		shards = self.getshards(fromtimestamp, totimestamp)
+		if len(shards) == 0:
+			return [ ]
+		elif len(shards) == 1:
+			return function(shards[0], fromtimestamp, totimestamp)
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers = self._maxworkers) as executor:
+			futures = [ executor.submit(function, shard, fromtimestamp, totimestamp) for shard in shards ]
+			results = [ future.result() for future in futures ]
+		return list(heapq.merge(*results))
+
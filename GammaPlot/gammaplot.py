@@ -32,7 +32,8 @@ import matplotlib.pyplot
 import matplotlib.mlab
 import matplotlib.dates
 
-from DataAcquisition import DataAcquisition, DatabaseDataSource
+from DataAcquisition import DataAcquisition, DatabaseDataSource, ArchiveDataSource, NpzDataSource
+from ColumnArchive import ColumnArchive
 from CmdLineParameters import CmdLineParameters
 
 cmdline = CmdLineParameters()
@@ -40,7 +41,12 @@ if cmdline["endtime"] < cmdline["starttime"]:
 	print("Error: Starrtime (%s) must be before endtime (%s)." % (cmdline["starttime"], cmdline["endtime"]), file = sys.stderr)
 	sys.exit(1)
 
-dbdatasrc = DatabaseDataSource(cmdline)
+if ColumnArchive.isarchive(cmdline["dbfile"]):
+	dbdatasrc = ArchiveDataSource(cmdline)
+elif cmdline["dbfile"].lower().endswith(".npz"):
+	dbdatasrc = NpzDataSource(cmdline)
+else:
+	dbdatasrc = DatabaseDataSource(cmdline)
 dacq = DataAcquisition(cmdline, dbdatasrc)
 (xpts, ypts) = dacq.getplotdata()
 
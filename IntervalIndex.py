@@ -0,0 +1,89 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+from DatabaseSchema import DatabaseSchema
+from Exceptions import InvalidArgumentException
+
+class IntervalIndex():
+	"""Overlap and gap queries on the intervals of a database. Overlaps are
+	looked up in the R*Tree of schema version 4, whose (rounded) coordinates
+	only preselect candidates; the exact comparison is always done on the
+	data table. Gaps only need the data table and work from schema version 2
+	on. Intervals only overlap or leave gaps with respect to other intervals
+	of the same device."""
+	def __init__(self, db):
+		self._db = db
+		self._version = DatabaseSchema.getversion(db)
+		self._hasrtree = DatabaseSchema.hasrtree(db)
+
+	def checkrtree(self):
+		"""Raises an exception if the database cannot answer overlap
+		queries."""
+		if not self._hasrtree:
+			raise InvalidArgumentException("Database has no interval index (requires schema version 4 and an SQLite library with R*Tree support). Use the 'migratedb' command first.")
+
+	def overlapping(self, serial, tfrom, tto):
+		"""Returns (id, tfrom, duration, counts) of all stored intervals of the
+		device that overlap [tfrom, tto)."""
+		self.checkrtree()
+		key = -1 if (serial is None) else serial
+		return self._db.execute("""SELECT d.id, d.tfrom, d.duration, d.counts FROM data_rtree r CROSS JOIN data d ON d.id = r.id
+			WHERE (r.tfrom < ?) AND (r.tto > ?) AND (r.smin <= ?) AND (r.smax >= ?)
+			AND (d.serial IS ?) AND (d.tfrom < ?) AND (d.tfrom + d.duration > ?) ORDER BY d.tfrom;""", tto, tfrom, key, key, serial, tto, tfrom).fetchall()
+
+	def overlaps(self):
+		"""Yields (serial, (id1, tfrom1, tto1), (id2, tfrom2, tto2)) for every
+		pair of overlapping intervals. Every interval is looked up in the
+		R*Tree once, i.e. this takes O(n log n) instead of the O(n^2) of a
+		plain self join."""
+		self.checkrtree()
+		# The join order is forced with CROSS JOIN: the planner otherwise tends
+		# to scan the R*Tree in the outer loop, which makes this quadratic
+		cursor = self._db.cursor().execute("""SELECT a.serial, a.id, a.tfrom, a.tfrom + a.duration, b.id, b.tfrom, b.tfrom + b.duration FROM data a
+			CROSS JOIN data_rtree r ON (r.tfrom < a.tfrom + a.duration) AND (r.tto > a.tfrom) AND (r.smin <= coalesce(a.serial, -1)) AND (r.smax >= coalesce(a.serial, -1)) AND (r.id > a.id)
+			CROSS JOIN data b ON b.id = r.id
+			WHERE (b.serial IS a.serial) AND (b.tfrom < a.tfrom + a.duration) AND (b.tfrom + b.duration > a.tfrom)
+			ORDER BY a.serial, a.tfrom;""")
+		for (serial, id1, tfrom1, tto1, id2, tfrom2, tto2) in cursor.fetchall_chunks():
+			yield (serial, (id1, tfrom1, tto1), (id2, tfrom2, tto2))
+
+	def gaps(self, mingap = 1):
+		"""Yields (serial, gapfrom, gapto) for every time range of at least
+		mingap seconds between the first and the last interval of a device
+		that is not covered by any interval. This is a single ordered scan over
+		the (serial, tfrom) index and needs no R*Tree."""
+		if self._version < 2:
+			raise InvalidArgumentException("Database uses schema version %d, but finding gaps requires version 2 or later. Use the 'migratedb' command first." % (self._version))
+		(lastserial, coveredto) = (None, None)
+		if self._version >= 3:
+			cursor = self._db.cursor().execute("SELECT serial, tfrom, duration FROM data ORDER BY serial, tfrom;")
+		else:
+			cursor = self._db.cursor().execute("SELECT NULL, tfrom, duration FROM data ORDER BY tfrom;")
+		for (serial, tfrom, duration) in cursor.fetchall_chunks():
+			if (coveredto is None) or (serial != lastserial):
+				(lastserial, coveredto) = (serial, tfrom + duration)
+				continue
+			if tfrom - coveredto >= mingap:
+				yield (serial, coveredto, tfrom)
+			coveredto = max(coveredto, tfrom + duration)
+
@@ -0,0 +1,202 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import os
+import time
+import zlib
+import struct
+import logging
+import threading
+
+class JournalException(Exception):
+	pass
+
+class Journal():
+	"""Append-only journal of intervals with fixed width records, meant to
+	make online recordings survive crashes and power failures.
+
+	File layout (all integers little endian):
+		header:		magic "GSJL", u16 version, u16 record size
+		records:	s64 tfrom, u32 duration, u32 counts, u32 crc32
+
+	The CRC covers the first 16 bytes of a record. Records are only appended;
+	after a crash, the file may end in a partially written or garbled record,
+	which is detected by its size or CRC. The journal is valid up to the
+	first such record."""
+	MAGIC = b"GSJL"
+	VERSION = 1
+
+	_header = struct.Struct("< 4s H H")
+	_data = struct.Struct("< q I I")
+	_record = struct.Struct("< q I I I")
+
+	@staticmethod
+	def isjournal(filename):
+		try:
+			with open(filename, "rb") as f:
+				return f.read(len(Journal.MAGIC)) == Journal.MAGIC
+		except IOError:
+			return False
+
+	@staticmethod
+	def _checkheader(filename, header):
+		if len(header) != Journal._header.size:
+			raise JournalException("'%s' is too short to be a journal." % (filename))
+		(magic, version, recordsize) = Journal._header.unpack(header)
+		if magic != Journal.MAGIC:
+			raise JournalException("'%s' is not a journal (wrong magic)." % (filename))
+		if (version != Journal.VERSION) or (recordsize != Journal._record.size):
+			raise JournalException("'%s' has journal version %d, only version %d is supported." % (filename, version, Journal.VERSION))
+
+	@staticmethod
+	def _pack(tfrom, duration, counts):
+		data = Journal._data.pack(tfrom, duration, counts)
+		return data + struct.pack("< I", zlib.crc32(data))
+
+	@staticmethod
+	def _validrecords(data):
+		"""Returns the number of valid records at the start of data, which
+		must not include the header."""
+		recordsize = Journal._record.size
+		for (recordno, (tfrom, duration, counts, crc)) in enumerate(Journal._record.iter_unpack(data[ : len(data) - (len(data) % recordsize)])):
+			if zlib.crc32(data[recordno * recordsize : recordno * recordsize + Journal._data.size]) != crc:
+				return recordno
+		return len(data) // recordsize
+
+
+class JournalWriter():
+	def __init__(self, filename, syncsecs = 5, maxpending = 4096):
+		"""Opens the journal for appending or creates it. The journal is synced
+		to disk at most once every syncsecs seconds: records that arrive
+		within that time after the last sync are collected and written and
+		synced together (group commit) when the syncsecs have passed, or
+		earlier when maxpending records are waiting. A timer makes sure that
+		this also happens when no further record arrives. Records that arrive
+		less often than that, like in online mode, are therefore synced
+		immediately; with syncsecs = 0, every record is. A damaged tail left
+		over by a crash is cut off when opening."""
+		self._log = logging.getLogger("gsu.journal." + self.__class__.__name__)
+		self._filename = filename
+		self._syncsecs = syncsecs
+		self._maxpending = maxpending
+		self._pending = [ ]
+		self._lastcommit = 0
+		self._lock = threading.Lock()
+		self._timer = None
+		self._fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+		size = os.fstat(self._fd).st_size
+		if size == 0:
+			os.write(self._fd, Journal._header.pack(Journal.MAGIC, Journal.VERSION, Journal._record.size))
+			os.fsync(self._fd)
+			self._syncdirectory()
+		else:
+			self._recover(size)
+
+	def _syncdirectory(self):
+		# Make sure the new directory entry itself is durable
+		try:
+			dirfd = os.open(os.path.dirname(os.path.abspath(self._filename)), os.O_RDONLY)
+		except OSError:
+			return
+		try:
+			os.fsync(dirfd)
+		except OSError:
+			pass
+		finally:
+			os.close(dirfd)
+
+	def _recover(self, size):
+		with open(self._filename, "rb") as f:
+			Journal._checkheader(self._filename, f.read(Journal._header.size))
+			data = f.read()
+		validsize = Journal._header.size + Journal._validrecords(data) * Journal._record.size
+		if validsize != size:
+			self._log.warning("Journal '%s' has a damaged tail, discarding %d bytes after %d valid records" % (self._filename, size - validsize, (validsize - Journal._header.size) // Journal._record.size))
+			os.ftruncate(self._fd, validsize)
+			os.fsync(self._fd)
+		os.lseek(self._fd, validsize, os.SEEK_SET)
+
+	def append(self, tfrom, duration, counts):
+		with self._lock:
+			self._pending.append(Journal._pack(tfrom, duration, counts))
+			remaining = self._syncsecs - (time.time() - self._lastcommit)
+			if (remaining <= 0) or (len(self._pending) >= self._maxpending):
+				self._commit()
+			elif self._timer is None:
+				self._timer = threading.Timer(remaining, self._deadline)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def _deadline(self):
+		try:
+			self.commit()
+		except OSError as e:
+			# The records stay pending and are retried with the next commit
+			self._log.error("Could not sync journal '%s': %s" % (self._filename, str(e)))
+
+	def commit(self):
+		"""Writes all pending records with a single system call and syncs them
+		to disk."""
+		with self._lock:
+			self._commit()
+
+	def _commit(self):
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+		if len(self._pending) == 0:
+			return
+		data = b"".join(self._pending)
+		while len(data) > 0:
+			written = os.write(self._fd, data)
+			data = data[written : ]
+		os.fsync(self._fd)
+		self._pending = [ ]
+		self._lastcommit = time.time()
+
+	def close(self):
+		self.commit()
+		os.close(self._fd)
+
+
+class JournalReader():
+	def __init__(self, filename):
+		self._log = logging.getLogger("gsu.journal." + self.__class__.__name__)
+		self._filename = filename
+		with open(filename, "rb") as f:
+			Journal._checkheader(filename, f.read(Journal._header.size))
+			self._data = f.read()
+		self._records = Journal._validrecords(self._data)
+		if self._records * Journal._record.size != len(self._data):
+			self._log.warning("Journal '%s' has a damaged tail, reading only the first %d records" % (filename, self._records))
+
+	def __len__(self):
+		return self._records
+
+	def __iter__(self):
+		"""Yields (tfrom, duration, counts) of all valid records."""
+		for (tfrom, duration, counts, crc) in Journal._record.iter_unpack(self._data[ : self._records * Journal._record.size]):
+			yield (tfrom, duration, counts)
+
+	def close(self):
+		self._data = None
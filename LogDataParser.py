@@ -47,7 +47,14 @@ class LogDataParser():
 		self._offset += length
 		return self._data[o : o + length]
 
+	def parse(self, length = None):
+		"""Passes all intervals of the log to the output backend."""
+		for (fromtime, totime, counts) in self.intervals(length):
+			self._output.newinterval(fromtime, totime, counts)
+
 	def _gotcounts(self, timesecs, counts, overflow = False):
+		"""Yields the interval that ends timesecs after the current date, if
+		there is one."""
 		if timesecs is None:
 			self._log.warn("0x%x: Got no timesecs, but %d counts, ignoring (overflow = %s)." % (self._offset, counts, overflow))
 			return
@@ -58,7 +65,7 @@ class LogDataParser():
 			self._log.warn("0x%x: Got timesecs %s, counts %d without an initial timevalue, ignoring (overflow = %s)." % (self._offset, str(timesecs), counts, overflow))
 			return
 		todate = self._curdate + datetime.timedelta(0, timesecs)
-		self._output.newinterval(self._curdate, todate, counts)
+		yield (self._curdate, todate, counts)
 		self._log.debug("0x%x: %s - %s: %d (overflow = %s)" % (self._offset, self._curdate, todate, counts, overflow))
 		self._curdate = todate
 
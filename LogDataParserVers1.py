@@ -29,7 +29,8 @@ class LogDataParserVers1(LogDataParser):
 	def __init__(self, data, outputbackend):
 		LogDataParser.__init__(self, data, outputbackend)
 
-	def parse(self, length = None):
+	def intervals(self, length = None):
+		"""Yields (fromtime, totime, counts) of all intervals in log order."""
 		serial_number_str = LogDataParser._hexdecify(self._data[0 : 3])
 		serial_number = (serial_number_str[2] * 10000) + (serial_number_str[1] * 100) + serial_number_str[0]
 
@@ -55,7 +56,7 @@ class LogDataParserVers1(LogDataParser):
 						self._log.debug("Gap: %d:%02d:%02d, Cts: %d, CPM: %.1f" % (gap // 3600, gap % 3600 // 60, gap % 60, cts, cts / gap * 60))
 					else:
 						self._log.debug("Zero gap: Cts: %s" % (cts))
-					self._gotcounts(gap, cts)
+					yield from self._gotcounts(gap, cts)
 				elif peek == 0xf4:
 					self._log.debug("Interval 1 minute")
 					self._nextbytes(1)
@@ -82,7 +83,7 @@ class LogDataParserVers1(LogDataParser):
 
 			else:
 				counts = self._expcts(self._nextbytes(2))
-				self._gotcounts(self._interval, counts)
+				yield from self._gotcounts(self._interval, counts)
 
 if __name__ == "__main__":
 	pass
@@ -29,7 +29,8 @@ class LogDataParserVers2(LogDataParser):
 	def __init__(self, data, outputbackend):
 		LogDataParser.__init__(self, data, outputbackend)
 
-	def parse(self, length = None):
+	def intervals(self, length = None):
+		"""Yields (fromtime, totime, counts) of all intervals in log order."""
 		self._offset = 0
 		self._overflow = False
 
@@ -52,7 +53,7 @@ class LogDataParserVers2(LogDataParser):
 					gap = ((data[1] << 8) | data[0]) * 10
 					cts = self._expcts(data[2 : 4])
 					self._log.debug("0x%x: Gap: %d:%02d:%02d, Cts: %d, CPM: %.1f" % (self._offset, gap // 3600, gap % 3600 // 60, gap % 60, cts, cts / gap * 60))
-					self._gotcounts(gap, cts)
+					yield from self._gotcounts(gap, cts)
 				elif peek == 0x0c:
 					self._log.debug("0x%x: Interval 10 seconds" % (self._offset))
 					self._nextbytes(1)
@@ -122,7 +123,7 @@ class LogDataParserVers2(LogDataParser):
 
 			else:
 				counts = self._expcts(self._nextbytes(2))
-				self._gotcounts(self._interval, counts, self._overflow)
+				yield from self._gotcounts(self._interval, counts, self._overflow)
 				self._overflow = False
 
 
@@ -0,0 +1,148 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import csv
+import mmap
+import datetime
+
+from Exceptions import InvalidArgumentException
+from CompressedFile import CompressedFile
+
+class LogSlicer():
+	"""Finds time ranges in CSV or TXT files written by the respective output
+	backends by binary search over byte offsets, so that extracting a range
+	only touches O(log n) lines besides the extracted ones. The file is
+	memory mapped; after jumping to an offset, the search resynchronizes to
+	the start of the next line and parses the start time of that line with
+	the date format that the file was written with. Rows must be sorted by
+	their start time, which is the case for everything the backends write."""
+	_HEADERLINES = 4
+
+	def __init__(self, filename, date_format):
+		if CompressedFile.compression(filename) is not None:
+			raise InvalidArgumentException("'%s' is compressed and cannot be searched, decompress it first." % (filename))
+		lowername = filename.lower()
+		if lowername.endswith(".csv"):
+			self._parsefield = LogSlicer._csvfield
+		elif lowername.endswith(".txt"):
+			self._parsefield = LogSlicer._txtfield
+		else:
+			raise InvalidArgumentException("'%s' is neither a .csv nor a .txt file." % (filename))
+		self._filename = filename
+		self._date_format = date_format
+		with open(filename, "rb") as f:
+			try:
+				self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+			except ValueError:
+				# Empty file, cannot be mapped
+				self._map = b""
+		self._size = len(self._map)
+		self._datastart = self._finddatastart()
+
+	@staticmethod
+	def _csvfield(line):
+		if line.startswith("\""):
+			return next(csv.reader([ line ]))[0]
+		return line.split(",", 1)[0]
+
+	@staticmethod
+	def _txtfield(line):
+		# The regular txt format pads the start time to 20 characters and
+		# separates columns by three spaces
+		return line.split("   ", 1)[0].rstrip()
+
+	def _linestart(self, offset):
+		"""Returns the offset of the first line that starts at or after
+		offset."""
+		if offset <= self._datastart:
+			return self._datastart
+		index = self._map.find(b"\n", offset - 1)
+		return self._size if (index == -1) else index + 1
+
+	def _lineend(self, offset):
+		index = self._map.find(b"\n", offset)
+		return self._size if (index == -1) else index + 1
+
+	def _parse(self, offset):
+		line = self._map[offset : self._lineend(offset)].decode("utf-8", errors = "replace").rstrip("\r\n")
+		try:
+			return datetime.datetime.strptime(self._parsefield(line), self._date_format)
+		except ValueError:
+			return None
+
+	def _finddatastart(self):
+		"""Skips the header lines, i.e. everything before the first line that
+		starts with a timestamp."""
+		offset = 0
+		for lineno in range(LogSlicer._HEADERLINES):
+			if offset >= self._size:
+				break
+			if self._parse(offset) is not None:
+				return offset
+			offset = self._lineend(offset)
+		if offset >= self._size:
+			return self._size
+		raise InvalidArgumentException("'%s' contains no timestamps in format '%s' at the start of its lines (only the default txt format and csv files can be sliced)." % (self._filename, self._date_format))
+
+	def _timestamp(self, offset):
+		timestamp = self._parse(offset)
+		if timestamp is None:
+			raise InvalidArgumentException("Line at offset %d of '%s' has no valid timestamp." % (offset, self._filename))
+		return timestamp
+
+	def offset(self, timestamp):
+		"""Returns the offset of the first line whose start time is not before
+		the timestamp, or the file size if there is none."""
+		(lo, hi) = (self._datastart, self._size)
+		# Invariant: all lines before lo start before timestamp, hi is the
+		# start of a line that does not (or the end of the file)
+		while True:
+			mid = (lo + hi) // 2
+			offset = self._linestart(mid + 1)
+			if offset >= hi:
+				break
+			if self._timestamp(offset) < timestamp:
+				lo = offset
+			else:
+				hi = offset
+
+		# Only a few lines are left between lo and hi
+		offset = lo
+		while (offset < hi) and (self._timestamp(offset) < timestamp):
+			offset = self._lineend(offset)
+		return offset
+
+	@property
+	def header(self):
+		return self._map[ : self._datastart]
+
+	def getrange(self, fromtime, totime):
+		"""Returns a memoryview of all lines whose start time lies within
+		[fromtime, totime)."""
+		start = self.offset(fromtime)
+		end = max(start, self.offset(totime))
+		return memoryview(self._map)[start : end]
+
+	def close(self):
+		if isinstance(self._map, mmap.mmap):
+			self._map.close()
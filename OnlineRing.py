@@ -0,0 +1,166 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import os
+import mmap
+import struct
+import datetime
+import calendar
+import collections
+
+OnlineReading = collections.namedtuple("OnlineReading", [ "seq", "utctimestamp", "interval", "counts", "usvperhr" ])
+
+class OnlineRingException(Exception):
+	pass
+
+class OnlineRing():
+	"""Fixed size file that holds the most recent online readings in a ring
+	of slots, so that local consumers can map it into memory and read the
+	newest values without any system call or database query.
+
+	File layout (all integers little endian):
+		header:		magic "GSRB", u16 version, u16 slot size, u32 slot count,
+					u64 sequence number of the newest reading (0 if empty)
+		slots:		u64 seq, s64 timestamp, u32 interval, u32 counts,
+					f64 usvperhr, u64 seq
+
+	Reading number seq (counting from 1) is stored in slot (seq - 1) modulo
+	the slot count. The writer stores the sequence number in front of and
+	behind the data of a slot and updates the header last; a reader that
+	finds both copies equal to the sequence number it expects has read a
+	consistent slot, otherwise the slot was overwritten meanwhile."""
+	MAGIC = b"GSRB"
+	VERSION = 1
+
+	_header = struct.Struct("< 4s H H I Q")
+	_seq = struct.Struct("< Q")
+	_slot = struct.Struct("< Q q I I d Q")
+	_SEQOFFSET = 12
+
+	@staticmethod
+	def filesize(slotcount):
+		return OnlineRing._header.size + slotcount * OnlineRing._slot.size
+
+	@staticmethod
+	def _slotoffset(slotcount, seq):
+		return OnlineRing._header.size + ((seq - 1) % slotcount) * OnlineRing._slot.size
+
+
+class OnlineRingWriter():
+	def __init__(self, filename, slotcount):
+		"""Opens the ring file or creates it if it does not exist yet. If an
+		existing file has the same number of slots, its readings are kept and
+		sequence numbers continue; otherwise it is recreated."""
+		assert(slotcount > 0)
+		self._slotcount = slotcount
+		size = OnlineRing.filesize(slotcount)
+		seq = 0
+		try:
+			self._f = open(filename, "r+b")
+			header = self._f.read(OnlineRing._header.size)
+			if (len(header) == OnlineRing._header.size) and (os.fstat(self._f.fileno()).st_size == size):
+				(magic, version, slotsize, filecount, fileseq) = OnlineRing._header.unpack(header)
+				if (magic, version, slotsize, filecount) == (OnlineRing.MAGIC, OnlineRing.VERSION, OnlineRing._slot.size, slotcount):
+					seq = fileseq
+		except IOError:
+			self._f = open(filename, "w+b")
+		if seq == 0:
+			self._f.truncate(0)
+			self._f.truncate(size)
+		self._map = mmap.mmap(self._f.fileno(), size)
+		OnlineRing._header.pack_into(self._map, 0, OnlineRing.MAGIC, OnlineRing.VERSION, OnlineRing._slot.size, slotcount, seq)
+		self._seq = seq
+
+	def append(self, utctimestamp, interval, counts, usvperhr):
+		self._seq += 1
+		timestamp = calendar.timegm(utctimestamp.utctimetuple())
+		OnlineRing._slot.pack_into(self._map, OnlineRing._slotoffset(self._slotcount, self._seq), self._seq, timestamp, interval, counts, usvperhr, self._seq)
+		OnlineRing._seq.pack_into(self._map, OnlineRing._SEQOFFSET, self._seq)
+
+	def close(self):
+		self._map.flush()
+		self._map.close()
+		self._f.close()
+
+
+class OnlineRingReader():
+	"""Reads a ring file that is concurrently written by the online command.
+	All accesses go to the memory mapping only."""
+	_MAXRETRIES = 100
+
+	def __init__(self, filename):
+		with open(filename, "rb") as f:
+			self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		if len(self._map) < OnlineRing._header.size:
+			raise OnlineRingException("'%s' is too short to be a ring file." % (filename))
+		(magic, version, slotsize, self._slotcount, seq) = OnlineRing._header.unpack_from(self._map, 0)
+		if magic != OnlineRing.MAGIC:
+			raise OnlineRingException("'%s' is not a ring file (wrong magic)." % (filename))
+		if (version != OnlineRing.VERSION) or (slotsize != OnlineRing._slot.size):
+			raise OnlineRingException("'%s' has ring version %d, only version %d is supported." % (filename, version, OnlineRing.VERSION))
+		if len(self._map) != OnlineRing.filesize(self._slotcount):
+			raise OnlineRingException("'%s' has the wrong size for %d slots." % (filename, self._slotcount))
+
+	@property
+	def slotcount(self):
+		return self._slotcount
+
+	@property
+	def seq(self):
+		"""Sequence number of the newest reading, 0 if there is none."""
+		return OnlineRing._seq.unpack_from(self._map, OnlineRing._SEQOFFSET)[0]
+
+	def _read(self, seq):
+		(seq1, timestamp, interval, counts, usvperhr, seq2) = OnlineRing._slot.unpack_from(self._map, OnlineRing._slotoffset(self._slotcount, seq))
+		if (seq1 != seq) or (seq2 != seq):
+			return None
+		return OnlineReading(seq = seq, utctimestamp = datetime.datetime.utcfromtimestamp(timestamp), interval = interval, counts = counts, usvperhr = usvperhr)
+
+	def latest(self):
+		"""Returns the newest reading or None if there is none. A read only
+		fails if the writer is overwriting the slot at the same time, so it is
+		retried a few times; if it keeps failing, the file is corrupt."""
+		for attempt in range(OnlineRingReader._MAXRETRIES):
+			seq = self.seq
+			if seq == 0:
+				return None
+			reading = self._read(seq)
+			if reading is not None:
+				return reading
+		raise OnlineRingException("Newest reading %d of the ring file is inconsistent after %d attempts, the file is corrupt." % (seq, OnlineRingReader._MAXRETRIES))
+
+	def since(self, seq):
+		"""Returns all readings that are still in the ring and newer than the
+		given sequence number, oldest first. Polling consumers pass the seq of
+		the last reading they have seen."""
+		newest = self.seq
+		readings = [ ]
+		for current in range(max(seq + 1, newest - self._slotcount + 1, 1), newest + 1):
+			reading = self._read(current)
+			if reading is not None:
+				# Readings that were overwritten while reading are skipped
+				readings.append(reading)
+		return readings
+
+	def close(self):
+		self._map.close()
@@ -21,6 +21,7 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 #
 
+import re
 import sys
 import csv
 import struct
@@ -28,18 +29,43 @@ import hashlib
 import logging
 import datetime
 import os
+import time
+import tempfile
+import mmap
+import array
+import collections
+import threading
+import gzip
+import urllib.request
+import urllib.parse
+import urllib.error
 try:
 	import pymysql
 except ImportError:
 	pymysql = None
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 import Globals
 from Exceptions import InvalidArgumentException
 from DosisConversion import DosisConversion
 from SQLite import SQLite
-
-def _strftimeexpand(filename, args):
-	if args["localstrftime"]:
+from DatabaseSchema import DatabaseSchema
+from TimeAlert import TimeAlert
+from CompressedFile import CompressedFile
+from ColumnArchive import ColumnArchiveWriter
+from Journal import JournalWriter, JournalException
+from ChunkStore import ChunkStore
+from IntervalIndex import IntervalIndex
+
+def _strftimeexpand(filename, args, timestamp = None):
+	"""Expands strftime substitutions with the current time or, if given, with
+	the (UTC) timestamp."""
+	if timestamp is not None:
+		now = timestamp
+	elif args["localstrftime"]:
 		now = datetime.datetime.now()
 	else:
 		now = datetime.datetime.utcnow()
@@ -74,99 +100,384 @@ class OutputBackend():
 		self._filename = filename
 		self._args = args
 
+	def setserial(self, serial):
+		"""Called before any data is passed if the serial number of the device
+		that the data comes from is known."""
+		pass
+
 	def initdata(self, logsize, datablob):
 		pass
 
 	def newinterval(self, fromtime, totime, counts):
 		pass
 
+	def flush(self):
+		"""Called in online mode after every reading. Intervals that the
+		backend buffers for batching should be handed to the operating system
+		now, so that readers of the output see them and a crash does not lose
+		them."""
+		pass
+
 	def close(self):
 		pass
 
 
+class OutputBackendMulti(OutputBackend):
+	"""Forwards everything to a list of output backends so that a single parse
+	of the log can feed any number of outputs. Backends that should not slow
+	down the others can be wrapped in an AsyncOutputBackend first."""
+	def __init__(self, backends):
+		OutputBackend.__init__(self, None, None)
+		self._backends = backends
+
+	def setserial(self, serial):
+		for backend in self._backends:
+			backend.setserial(serial)
+
+	def initdata(self, logsize, datablob):
+		for backend in self._backends:
+			backend.initdata(logsize, datablob)
+
+	def newinterval(self, fromtime, totime, counts):
+		for backend in self._backends:
+			backend.newinterval(fromtime, totime, counts)
+
+	def flush(self):
+		for backend in self._backends:
+			backend.flush()
+
+	def close(self):
+		# Close all backends even if one of them fails, then report the first
+		# error
+		exception = None
+		for backend in self._backends:
+			try:
+				backend.close()
+			except Exception as e:
+				if exception is None:
+					exception = e
+		if exception is not None:
+			raise exception
+
+
+class OutputBackendAggregate(OutputBackend):
+	"""Sums up the intervals into buckets of fixed length (aligned in UTC)
+	while the log is being parsed and passes one interval per bucket on to the
+	wrapped backend. Intervals that cross a bucket boundary are split and
+	their counts are distributed proportionally to the time in each bucket.
+	Every emitted interval starts at the earliest time covered in its bucket
+	and its duration is the total covered time, so that dose rates stay
+	correct even if there are gaps. Fractional counts that result from
+	splitting are carried over to the next bucket, so the sum of all counts is
+	exact."""
+	aggregations = collections.OrderedDict([
+		("hourly",	3600),
+		("daily",	86400),
+	])
+
+	def __init__(self, backend, aggregation):
+		OutputBackend.__init__(self, None, None)
+		self._backend = backend
+		self._bucketsecs = OutputBackendAggregate.aggregations[aggregation]
+		self._bucket = None
+		self._firstfrom = None
+		self._duration = 0
+		self._counts = 0
+		self._carry = 0
+
+	def setserial(self, serial):
+		self._backend.setserial(serial)
+
+	def initdata(self, logsize, datablob):
+		self._backend.initdata(logsize, datablob)
+
+	def _emit(self):
+		if self._bucket is None:
+			return
+		counts = self._counts + self._carry
+		intcounts = int(round(counts))
+		self._carry = counts - intcounts
+		fromtime = DatabaseSchema.epoch_to_datetime(self._firstfrom)
+		self._backend.newinterval(fromtime, fromtime + datetime.timedelta(0, self._duration), intcounts)
+		self._bucket = None
+
+	def _add(self, tfrom, duration, counts):
+		bucket = tfrom - (tfrom % self._bucketsecs)
+		if bucket != self._bucket:
+			self._emit()
+			(self._bucket, self._firstfrom, self._duration, self._counts) = (bucket, tfrom, 0, 0)
+		self._duration += duration
+		self._counts += counts
+
+	def newinterval(self, fromtime, totime, counts):
+		tfrom = DatabaseSchema.datetime_to_epoch(fromtime)
+		tto = DatabaseSchema.datetime_to_epoch(totime)
+		if tto <= tfrom:
+			self._add(tfrom, 0, counts)
+			return
+
+		duration = tto - tfrom
+		while tfrom < tto:
+			end = min(tto, tfrom - (tfrom % self._bucketsecs) + self._bucketsecs)
+			self._add(tfrom, end - tfrom, counts * (end - tfrom) / duration)
+			tfrom = end
+
+	def flush(self):
+		self._backend.flush()
+
+	def close(self):
+		self._emit()
+		self._backend.close()
+
+
 class FileWrapper():
-	def __init__(self, filename, args):
+	"""Text output file (or stdout) that collects written strings and hands
+	them to the underlying file in large chunks. With --line-buffered,
+	everything is written and flushed immediately; in online mode, the
+	backends flush after every reading."""
+	_MAX_PENDING = 512
+
+	def __init__(self, filename, args, buffersize = 256 * 1024):
 		self._filename = filename
 		self._args = args
+		self._linebuffered = args["line_buffered"]
+		self._pending = [ ]
 		if self._filename == "-":
 			self._f = sys.stdout
+			if self._f.isatty():
+				# Keep interactive output (e.g. in online mode) immediate
+				self._linebuffered = True
 		else:
-			self._f = open(filename, "w", encoding = "utf-8")
+			self._f = CompressedFile.open(filename, "w", level = args["compress_level"], threaded = args["compress_thread"], buffersize = buffersize)
 
-	def write(self, data, **kwargs):
+	def _write(self, data):
 		try:
-			result = self._f.write(data, **kwargs)
+			self._f.write(data)
 		except UnicodeEncodeError:
 			data = data.replace("µ", "u")
 			data = data.encode("ascii", errors = "replace").decode("ascii")
-			result = self._f.write(data, **kwargs)
-		if self._args["line_buffered"]:
+			self._f.write(data)
+
+	def write(self, data):
+		if self._linebuffered:
+			self._write(data)
 			self._f.flush()
-		return result
+		else:
+			self._pending.append(data)
+			if len(self._pending) >= FileWrapper._MAX_PENDING:
+				self._flushpending()
+		return len(data)
+
+	def _flushpending(self):
+		if len(self._pending) > 0:
+			self._write("".join(self._pending))
+			self._pending = [ ]
+
+	def flush(self):
+		"""Hands everything written so far to the operating system."""
+		self._flushpending()
+		self._f.flush()
 
 	def close(self):
+		self._flushpending()
 		if self._filename != "-":
 			self._f.close()
+		else:
+			self._f.flush()
+
+
+class FormatCache():
+	"""Memoizes the per-row work of the textual output backends. Consecutive
+	intervals share their boundary timestamps and the same (counts, seconds)
+	pairs occur over and over, so formatting each timestamp, converting each
+	count rate to a dose rate and formatting the numeric columns only once
+	saves most of the time. The caches are simply discarded when they grow
+	too large.
+
+	tailformat, if given, is called as tailformat(counts, totalseconds, cps,
+	cpm, usvperhr) and returns the part of an output row that only depends on
+	these values."""
+	def __init__(self, date_format, tailformat = None, maxentries = 4096):
+		self._date_format = date_format
+		self._isoformat = (date_format == "%Y-%m-%d %H:%M:%S")
+		self._tailformat = tailformat
+		self._maxentries = maxentries
+		self._timestamps = { }
+		self._rates = { }
+		self._tails = { }
+
+	def _strftime(self, timestamp):
+		if self._isoformat and (timestamp.microsecond == 0):
+			# str() gives the same result as the default date format, but is
+			# considerably faster than strftime()
+			return str(timestamp)
+		return timestamp.strftime(self._date_format)
+
+	def timestamp(self, timestamp):
+		result = self._timestamps.get(timestamp)
+		if result is None:
+			if len(self._timestamps) >= self._maxentries:
+				self._timestamps = { }
+			result = self._strftime(timestamp)
+			self._timestamps[timestamp] = result
+		return result
+
+	def rates(self, counts, totalseconds):
+		"""Returns a (cps, cpm, usvperhr) tuple."""
+		key = (counts, totalseconds)
+		result = self._rates.get(key)
+		if result is None:
+			if len(self._rates) >= self._maxentries:
+				self._rates = { }
+			cps = counts / totalseconds
+			result = (cps, 60 * cps, DosisConversion.cts_per_sec_to_usv_per_hr(cps))
+			self._rates[key] = result
+		return result
+
+	def tail(self, counts, totalseconds):
+		key = (counts, totalseconds)
+		result = self._tails.get(key)
+		if result is None:
+			if len(self._tails) >= self._maxentries:
+				self._tails = { }
+			result = self._tailformat(counts, totalseconds, *self.rates(counts, totalseconds))
+			self._tails[key] = result
+		return result
 
 
 class OutputBackendBIN(OutputBackend):
+	_HASHCHUNK = 1024 * 1024
+
 	def __init__(self, filename, args):
 		OutputBackend.__init__(self, filename, args)
-		self._f = open(_strftimeexpand(filename, args), "wb")
+		self._f = CompressedFile.open(_strftimeexpand(filename, args), "wb", level = args["compress_level"], threaded = args["compress_thread"])
 
-	def initdata(self, logsize, datablob):
+	@staticmethod
+	def serialize(logsize, datablob):
+		"""Returns the binary file representation of the raw log."""
 		data = ("Gamma scout binary data blob " + Globals.VERSION).encode("utf-8")
 		data += bytes([ 0 ])
 		data += struct.pack("<L", logsize)
 		data += datablob
-		self._f.write(data)
 
 		# Append SHA-256 hash of data
-		self._f.write(hashlib.sha256(data).digest())
+		return data + hashlib.sha256(data).digest()
+
+	def initdata(self, logsize, datablob):
+		self._f.write(OutputBackendBIN.serialize(logsize, datablob))
 
 	@staticmethod
 	def readdata(filename, force):
+		"""Returns (logsize, logdata) of a binary file, where logdata is a
+		memoryview of the raw log. Uncompressed files are memory mapped and
+		neither the hash calculation nor the returned view copy any data;
+		compressed files and chunk store manifests have to be read into memory
+		first, but are not copied afterwards either."""
 		log = logging.getLogger("gsu.fileops." + __class__.__name__)
 
-		data = open(filename, "rb").read()
-		hashval = data[-32:]
-		data = data[:-32]
-		calchash = hashlib.sha256(data).digest()
-		if calchash != hashval:
+		if filename.endswith(".manifest"):
+			# Dump that was put into a chunk store by the store backend
+			data = ChunkStore.get(filename)
+		elif CompressedFile.compression(filename) is not None:
+			with CompressedFile.open(filename, "rb") as f:
+				data = f.read()
+		else:
+			with open(filename, "rb") as f:
+				try:
+					data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+				except ValueError:
+					# Empty files cannot be mapped
+					data = b""
+		view = memoryview(data)
+		if len(view) < 32 + 5:
+			raise InvalidArgumentException("File '%s' is too short to contain a binary log." % (filename))
+
+		payloadsize = len(view) - 32
+		hasher = hashlib.sha256()
+		for offset in range(0, payloadsize, OutputBackendBIN._HASHCHUNK):
+			hasher.update(view[offset : min(offset + OutputBackendBIN._HASHCHUNK, payloadsize)])
+		if hasher.digest() != view[payloadsize : ]:
 			if not force:
 				raise InvalidArgumentException("File has incorrect hash value, will not read it without specification of --force")
 
-		loc = data.index(bytes([0]))
-		version = data[:loc].decode("utf-8")
+		loc = data.find(bytes([0]), 0, payloadsize)
+		if loc == -1:
+			raise InvalidArgumentException("File '%s' has no header, it is not a binary log." % (filename))
+		version = bytes(view[:loc]).decode("utf-8")
 		log.debug("Reading file data from file generated by %s" % (version))
-		data = data[loc + 1:]
 
-		(length,) = struct.unpack("<L", data[:4])
-		data = data[4:]
-		return (length, data)
+		(length,) = struct.unpack_from("<L", view, loc + 1)
+		return (length, view[loc + 5 : payloadsize])
 
 
 	def close(self):
 		self._f.close()
 
 
+class OutputBackendStore(OutputBackend):
+	"""Puts the binary dump into a deduplicating chunk store. Consecutive dumps
+	of a log that has not been cleared share most of their chunks, so the
+	store only grows by the data that is actually new. The manifest that is
+	written for every dump can be read back with 'readbinlog'."""
+	def __init__(self, connstring, args):
+		OutputBackend.__init__(self, connstring, args)
+		self._storedef = _parseconnstr(connstring, {
+			"root":		None,
+			"name":		"%Y/%m/%Y-%m-%d-%H-%M-%S",
+		})
+		if self._storedef["root"] is None:
+			raise InvalidArgumentException("The store backend requires the 'root' key in its connection string.")
+		self._store = ChunkStore(self._storedef["root"])
+		self._manifestname = _strftimeexpand(os.path.join(self._storedef["root"], self._storedef["name"] + ".manifest"), args)
+
+	def initdata(self, logsize, datablob):
+		self._store.put(self._manifestname, OutputBackendBIN.serialize(logsize, datablob))
+
+
 class OutputBackendCSV(OutputBackend):
+	_SPECIALCHARS = set(",\"\r\n")
+
 	def __init__(self, filename, args):
 		OutputBackend.__init__(self, filename, args)
 		self._f = FileWrapper(_strftimeexpand(filename, args), args)
 		self._csv = csv.writer(self._f)
+		self._cache = FormatCache(self._args["date_format"], tailformat = lambda counts, totalseconds, cps, cpm, usvperhr: ",%d,%d,%r,%r,%r\r\n" % (counts, totalseconds, cpm, cps, usvperhr))
 		if not self._args["noheader"]:
 			self._csv.writerow(["From", "To", "Counts", "Seconds", "CPM", "CPS", "µSv/h"])
 
 	def newinterval(self, fromtime, totime, counts):
 		delta = (totime - fromtime)
 		totalseconds = delta.days * 86400 + delta.seconds
-		cps = counts / totalseconds
-		self._csv.writerow([ fromtime.strftime(self._args["date_format"]), totime.strftime(self._args["date_format"]), counts, totalseconds, 60 * cps, cps, DosisConversion.cts_per_sec_to_usv_per_hr(cps) ])
+		fromstr = self._cache.timestamp(fromtime)
+		tostr = self._cache.timestamp(totime)
+		if OutputBackendCSV._SPECIALCHARS.isdisjoint(fromstr) and OutputBackendCSV._SPECIALCHARS.isdisjoint(tostr):
+			self._f.write(fromstr + "," + tostr + self._cache.tail(counts, totalseconds))
+		else:
+			# Timestamps need quoting, let the csv module take care of that
+			(cps, cpm, usvperhr) = self._cache.rates(counts, totalseconds)
+			self._csv.writerow([ fromstr, tostr, counts, totalseconds, cpm, cps, usvperhr ])
+
+	def flush(self):
+		self._f.flush()
 
 	def close(self):
 		self._f.close()
 
+	@staticmethod
+	def readdata(filename, date_format):
+		"""Yields (fromtime, totime, counts) for all rows of a CSV file that was
+		written by this backend with the given date format. Rows that do not
+		start with a timestamp (i.e. the header) are skipped."""
+		with CompressedFile.open(filename, "r") as f:
+			for row in csv.reader(f):
+				if len(row) < 3:
+					continue
+				try:
+					fromtime = datetime.datetime.strptime(row[0], date_format)
+				except ValueError:
+					continue
+				yield (fromtime, datetime.datetime.strptime(row[1], date_format), int(row[2]))
+
 
 class OutputBackendTXT(OutputBackend):
 	def get_known_args():
@@ -176,55 +487,86 @@ class OutputBackendTXT(OutputBackend):
 		OutputBackend.__init__(self, filename, args)
 		self._sampleno = 0
 		self._f = FileWrapper(_strftimeexpand(filename, args), args)
+		if self._args["txt_format"] is not None:
+			self._cache = FormatCache(self._args["date_format"])
+			self._newinterval = self._newinterval_custom
+		elif self._args["gstool_txt_format"]:
+			self._cache = FormatCache(self._args["date_format"], tailformat = lambda counts, totalseconds, cps, cpm, usvperhr: "%010d      %-6.3f  %5.3f\n" % (counts, cps, usvperhr))
+			self._newinterval = self._newinterval_gstool
+		else:
+			self._cache = FormatCache(self._args["date_format"], tailformat = lambda counts, totalseconds, cps, cpm, usvperhr: "%6d   %6d   %6.1f   %7.3f   %6.3f\n" % (counts, totalseconds, cpm, cps, usvperhr))
+			self._newinterval = self._newinterval_regular
 		if (not self._args["noheader"]) and (not self._args["txt_format"]):
 			heading = "%-20s   %-20s   %6s  %6s   %4s   %5s   %6s" % ("From", "To", "Counts", "Seconds", "CPM", "CPS", "µSv/hr")
 			print(heading, file = self._f)
 			print("-" * len(heading), file = self._f)
 
-	def newinterval(self, fromtime, totime, counts):
-		self._sampleno += 1
-		delta = (totime - fromtime)
-		totalseconds = round(delta.days * 86400 + delta.seconds)
-		cps = counts / totalseconds
-
-		midtime = fromtime + datetime.timedelta(0, totalseconds / 2)
-
-		intervallenstr = {
+	@staticmethod
+	def _intervallenstr(totalseconds):
+		return {
 			300:	"5 min",
 			600:	"10 min",
 		}.get(totalseconds, "?")
 
+	def _newinterval_regular(self, fromtime, totime, counts, totalseconds):
+		self._f.write("%-20s   %-20s   " % (self._cache.timestamp(fromtime), self._cache.timestamp(totime)) + self._cache.tail(counts, totalseconds))
+
+	def _newinterval_gstool(self, fromtime, totime, counts, totalseconds):
+		self._f.write("%04d    %-7s %-19s     %-19s     " % (self._sampleno, OutputBackendTXT._intervallenstr(totalseconds), self._cache.timestamp(fromtime), self._cache.timestamp(totime)) + self._cache.tail(counts, totalseconds))
+
+	def _newinterval_custom(self, fromtime, totime, counts, totalseconds):
+		(cps, cpm, usvperhr) = self._cache.rates(counts, totalseconds)
+		midtime = fromtime + datetime.timedelta(0, totalseconds / 2)
 		variables = {
-			"fromtime":			fromtime.strftime(self._args["date_format"]),
-			"totime":			totime.strftime(self._args["date_format"]),
+			"fromtime":			self._cache.timestamp(fromtime),
+			"totime":			self._cache.timestamp(totime),
 			"midtime":			midtime.strftime(self._args["date_format"]),
 			"counts":			counts,
 			"intervallen":		totalseconds,
 			"cps":				cps,
-			"cpm":				60 * cps,
-			"usvperhr":			DosisConversion.cts_per_sec_to_usv_per_hr(cps),
+			"cpm":				cpm,
+			"usvperhr":			usvperhr,
 			"sampleno":			self._sampleno,
-			"intervallenstr":	intervallenstr,
+			"intervallenstr":	OutputBackendTXT._intervallenstr(totalseconds),
 		}
-		if self._args["txt_format"] is None:
-			if not self._args["gstool_txt_format"]:
-				# Regular format
-				print("%(fromtime)-20s   %(totime)-20s   %(counts)6d   %(intervallen)6d   %(cpm)6.1f   %(cps)7.3f   %(usvperhr)6.3f" % (variables), file = self._f)
-			else:
-				# GSTool format
-				print("%(sampleno)04d    %(intervallenstr)-7s %(fromtime)-19s     %(totime)-19s     %(counts)010d      %(cps)-6.3f  %(usvperhr)5.3f" % (variables), file = self._f)
-		else:
-			# Custom format
-			print(self._args["txt_format"] % (variables), file = self._f)
+		print(self._args["txt_format"] % (variables), file = self._f)
+
+	def newinterval(self, fromtime, totime, counts):
+		self._sampleno += 1
+		delta = (totime - fromtime)
+		totalseconds = round(delta.days * 86400 + delta.seconds)
+		self._newinterval(fromtime, totime, counts, totalseconds)
+
+	def flush(self):
+		self._f.flush()
 
 	def close(self):
 		self._f.close()
 
+	@staticmethod
+	def readdata(filename, date_format):
+		"""Yields (fromtime, totime, counts) for all rows of a file in the
+		regular txt format that was written with the given date format, whose
+		columns are separated by at least three spaces. The header lines are
+		skipped."""
+		separator = re.compile(r"\s{3,}")
+		with CompressedFile.open(filename, "r") as f:
+			for line in f:
+				fields = separator.split(line.strip())
+				if len(fields) < 3:
+					continue
+				try:
+					fromtime = datetime.datetime.strptime(fields[0], date_format)
+				except ValueError:
+					continue
+				yield (fromtime, datetime.datetime.strptime(fields[1], date_format), int(fields[2]))
+
 
 class OutputBackendXML(OutputBackend):
 	def __init__(self, filename, args):
 		OutputBackend.__init__(self, filename, args)
 		self._f = FileWrapper(_strftimeexpand(filename, args), args)
+		self._cache = FormatCache(self._args["date_format"], tailformat = lambda counts, totalseconds, cps, cpm, usvperhr: " secs=\"%s\" counts=\"%d\" doserate=\"%.5f\" />\n" % (totalseconds, counts, usvperhr))
 		if not self._args["noheader"]:
 			print("<?xml version=\"1.0\" encoding=\"utf-8\" ?>", file = self._f)
 			print("<gammascout>", file = self._f)
@@ -232,9 +574,7 @@ class OutputBackendXML(OutputBackend):
 	def newinterval(self, fromtime, totime, counts):
 		delta = (totime - fromtime)
 		totalseconds = delta.days * 86400 + delta.seconds
-		cps = counts / totalseconds
-		doserate = DosisConversion.cts_per_sec_to_usv_per_hr(cps)
-		print("	<interval from=\"%s\" to=\"%s\" secs=\"%s\" counts=\"%d\" doserate=\"%.5f\" />" % (fromtime.strftime(self._args["date_format"]), totime.strftime(self._args["date_format"]), totalseconds, counts, doserate), file = self._f)
+		self._f.write("	<interval from=\"%s\" to=\"%s\"" % (self._cache.timestamp(fromtime), self._cache.timestamp(totime)) + self._cache.tail(counts, totalseconds))
 
 	def close(self):
 		print("</gammascout>", file = self._f)
@@ -244,56 +584,276 @@ class OutputBackendXML(OutputBackend):
 class OutputBackendSqlite(OutputBackend):
 	def __init__(self, filename, args):
 		OutputBackend.__init__(self, filename, args)
-		self._db = SQLite(_strftimeexpand(filename, args))
-		self._db.exec_mayfail_commit("""CREATE TABLE metadata (
-			key character varying PRIMARY KEY,
-			value character varying NOT NULL
-		);""")
-		self._db.exec_mayfail_commit("INSERT INTO metadata (key, value) VALUES ('dbversion', '1');")
-		self._db.exec_mayfail_commit("""CREATE TABLE data (
-			id integer PRIMARY KEY,
-			tfrom timestamp NOT NULL,
-			tto timestamp NOT NULL,
-			counts integer NOT NULL,
-			CHECK(tto > tfrom),
-			CHECK(counts >= 0)
-		);""")
+		self._log = logging.getLogger("gsu.output." + self.__class__.__name__)
+		self._db = SQLite(_strftimeexpand(filename, args), timeout = args["sqlite_busy_timeout"], busyretries = 5)
+		self._db.pragma("journal_mode", args["sqlite_journal_mode"])
+		self._db.pragma("synchronous", args["sqlite_synchronous"])
+		self._dbversion = DatabaseSchema.open(self._db)
+		if self._dbversion > DatabaseSchema.CURRENT_VERSION:
+			raise InvalidArgumentException("Database uses schema version %d, but only versions up to %d are supported." % (self._dbversion, DatabaseSchema.CURRENT_VERSION))
+		elif self._dbversion < DatabaseSchema.CURRENT_VERSION:
+			self._log.warning("Database uses outdated schema version %d, consider upgrading it with the 'migratedb' command." % (self._dbversion))
+		self._batchsize = args["sqlite_batch_size"]
+		self._commitrows = args["sqlite_commit_rows"]
+		self._commitalert = TimeAlert(args["sqlite_commit_interval"])
+		self._rows = [ ]
+		self._uncommitted = 0
+		self._rowcount = 0
+		self._skipcount = 0
+		self._serial = None
+		self._watermark = None
+		self._havewatermark = args["nowatermark"]
+		self._timerange = None
+		self._overlappolicy = args["overlap_policy"]
+		self._intervals = None
+		self._pendingend = None
+		self._rejectcount = 0
+		self._mergecount = 0
+		if self._overlappolicy != "keep":
+			if self._dbversion < 4:
+				raise InvalidArgumentException("Overlap policy '%s' requires a database of schema version 4, use the 'migratedb' command first." % (self._overlappolicy))
+			self._intervals = IntervalIndex(self._db)
+			self._intervals.checkrtree()
+			# The overlap check of every row already catches intervals that
+			# were imported before; the watermark would also skip intervals
+			# that fill gaps
+			self._havewatermark = True
+		self._t0 = time.time()
+
+	def setserial(self, serial):
+		self._serial = serial
+
+	def _getwatermark(self):
+		# Intervals that start at or before the newest stored interval (of the
+		# same device) have already been imported by a previous readout. This
+		# is a single lookup on the index instead of a check per row. It can
+		# only be done once the serial number is known, i.e. before the first
+		# interval is inserted.
+		if self._dbversion >= 3:
+			(self._watermark, ) = self._db.execute("SELECT MAX(tfrom) FROM data WHERE serial IS ?;", self._serial).fetchone()
+			if (self._watermark is None) and (self._serial is not None):
+				# The device writes to this database for the first time. Rows
+				# without serial number were imported before the schema knew
+				# serial numbers or from files; they most likely come from this
+				# device and must not be inserted a second time.
+				(self._watermark, ) = self._db.execute("SELECT MAX(tfrom) FROM data WHERE serial IS NULL;").fetchone()
+		else:
+			(self._watermark, ) = self._db.execute("SELECT MAX(tfrom) FROM data;").fetchone()
+		if self._watermark is not None:
+			self._log.debug("Skipping intervals up to watermark %s" % (self._watermark))
+		self._havewatermark = True
+
+	def _flush(self):
+		if len(self._rows) > 0:
+			if self._dbversion == 1:
+				self._db.executemany("INSERT INTO data (tfrom, tto, counts) VALUES (?, ?, ?);", self._rows)
+			elif self._dbversion == 2:
+				self._db.executemany("INSERT INTO data (tfrom, duration, counts) VALUES (?, ?, ?);", self._rows)
+			else:
+				self._db.executemany("INSERT INTO data (serial, tfrom, duration, counts) VALUES (?, ?, ?, ?);", self._rows)
+			self._rowcount += len(self._rows)
+			self._uncommitted += len(self._rows)
+			self._rows = [ ]
+			self._pendingend = None
+
+	def _resolveoverlap(self, row):
+		"""Applies the overlap policy to a row of schema version 4. Returns the
+		row that is to be inserted or None if the row is rejected."""
+		(serial, tfrom, duration, counts) = row
+		tto = tfrom + duration
+		if (self._pendingend is not None) and (tfrom < self._pendingend):
+			# The row may overlap rows that have not been inserted yet
+			self._flush()
+		overlapping = self._intervals.overlapping(serial, tfrom, tto)
+		self._pendingend = tto if (self._pendingend is None) else max(self._pendingend, tto)
+		if len(overlapping) == 0:
+			return row
+		elif self._overlappolicy == "reject":
+			self._rejectcount += 1
+			return None
+
+		# Merge the row with all overlapping intervals into one interval. Only
+		# the part of the new interval that is not covered yet is added, with
+		# its counts scaled proportionally, so that duplicates are not counted
+		# twice. Like for compaction, the result starts at the earliest tfrom
+		# and its duration is the sum of all measuring times.
+		covered = sum(max(0, min(tto, otfrom + oduration) - max(tfrom, otfrom)) for (oid, otfrom, oduration, ocounts) in overlapping)
+		uncovered = max(0, duration - covered)
+		for (oid, otfrom, oduration, ocounts) in overlapping:
+			self._db.execute("DELETE FROM data WHERE id = ?;", oid)
+			self._pendingend = max(self._pendingend, otfrom + oduration)
+		self._mergecount += 1
+		mergedfrom = min([ tfrom ] + [ otfrom for (oid, otfrom, oduration, ocounts) in overlapping ])
+		mergedduration = uncovered + sum(oduration for (oid, otfrom, oduration, ocounts) in overlapping)
+		mergedcounts = round(counts * uncovered / duration) + sum(ocounts for (oid, otfrom, oduration, ocounts) in overlapping)
+		return (serial, mergedfrom, mergedduration, mergedcounts)
+
+	def _commit(self):
+		# Commit in bounded batches so that the write lock is never held for
+		# the duration of a whole import and other writers get their turn
+		self._flush()
+		self._db.commit()
+		self._uncommitted = 0
+		self._commitalert.reset()
 
 	def newinterval(self, fromtime, totime, counts):
-		self._db.execute("INSERT INTO data (tfrom, tto, counts) VALUES (?, ?, ?);", fromtime, totime, counts)
+		if not self._havewatermark:
+			self._getwatermark()
+		if self._dbversion == 1:
+			row = (fromtime, totime, counts)
+			tfrom = str(fromtime)
+		else:
+			delta = (totime - fromtime)
+			tfrom = DatabaseSchema.datetime_to_epoch(fromtime)
+			if self._dbversion == 2:
+				row = (tfrom, delta.days * 86400 + delta.seconds, counts)
+			else:
+				row = (self._serial, tfrom, delta.days * 86400 + delta.seconds, counts)
+		if (self._watermark is not None) and (tfrom <= self._watermark):
+			self._skipcount += 1
+			return
+		if self._intervals is not None:
+			row = self._resolveoverlap(row)
+			if row is None:
+				return
+		if self._timerange is None:
+			self._timerange = [ tfrom, tfrom ]
+		else:
+			self._timerange = [ min(self._timerange[0], tfrom), max(self._timerange[1], tfrom) ]
+		self._rows.append(row)
+		if len(self._rows) >= self._batchsize:
+			self._flush()
+			if self._uncommitted >= self._commitrows:
+				self._commit()
+		if self._commitalert.triggered():
+			self._commit()
 
 	def close(self):
-		self._db.commit()
+		if self._dbversion >= 3:
+			# Record the readout in the ledger
+			(tfirst, tlast) = self._timerange or (None, None)
+			self._db.execute("INSERT INTO readouts (serial, treadout, tfirst, tlast, rows, skipped) VALUES (?, ?, ?, ?, ?, ?);", self._serial, int(time.time()), tfirst, tlast, self._rowcount + len(self._rows), self._skipcount)
+		self._commit()
+		t = time.time() - self._t0
+		if t > 0:
+			self._log.info("Inserted %d new rows in %.2f sec (%.0f rows/sec), skipped %d already stored rows" % (self._rowcount, t, self._rowcount / t, self._skipcount))
+		if self._intervals is not None:
+			self._log.info("Overlapping intervals: %d rejected, %d merged" % (self._rejectcount, self._mergecount))
+
+
+class OutputBackendSqliteShards(OutputBackend):
+	"""Splits the intervals over several SQLite databases: the strftime
+	substitutions of the filename are expanded with the start time of every
+	interval instead of the current time, so that e.g. "db/%Y-%m.sqlite"
+	creates one shard per month. Only a few shards are kept open at the same
+	time."""
+	_MAXOPEN = 4
+
+	def __init__(self, filename, args):
+		OutputBackend.__init__(self, filename, args)
+		self._shards = collections.OrderedDict()
+		self._serial = None
+		self._currenthour = None
+		self._currentshard = None
+
+	def setserial(self, serial):
+		self._serial = serial
+		for shard in self._shards.values():
+			shard.setserial(serial)
+
+	def _getshard(self, fromtime):
+		# Shards are at most hourly, so the filename only has to be expanded
+		# (and its directory created) when an interval starts in a new hour.
+		# The current shard is the most recently used one and cannot have
+		# been closed meanwhile.
+		hour = fromtime.replace(minute = 0, second = 0, microsecond = 0)
+		if hour != self._currenthour:
+			self._currentshard = self._openshard(_strftimeexpand(self._filename, self._args, hour))
+			self._currenthour = hour
+		return self._currentshard
+
+	def _openshard(self, filename):
+		shard = self._shards.get(filename)
+		if shard is not None:
+			self._shards.move_to_end(filename)
+		else:
+			if len(self._shards) >= OutputBackendSqliteShards._MAXOPEN:
+				(oldfilename, oldshard) = self._shards.popitem(last = False)
+				oldshard.close()
+			shard = OutputBackendSqlite(filename, self._args)
+			shard.setserial(self._serial)
+			self._shards[filename] = shard
+		return shard
+
+	def newinterval(self, fromtime, totime, counts):
+		self._getshard(fromtime).newinterval(fromtime, totime, counts)
+
+	def flush(self):
+		for shard in self._shards.values():
+			shard.flush()
+
+	def close(self):
+		while len(self._shards) > 0:
+			(filename, shard) = self._shards.popitem(last = False)
+			shard.close()
 
 
 class OutputBackendSQL(OutputBackend):
 	def __init__(self, connstring, args):
 		OutputBackend.__init__(self, connstring, args)
 		self._dbdef = _parseconnstr(connstring, {
-			"file":			"-",
-			"dialect":		"sqlite",
-			"dbname":		"gammascout",
-			"tablename":	"data",
+			"file":				"-",
+			"dialect":			"sqlite",
+			"dbname":			"gammascout",
+			"tablename":		"data",
+			"rowsperinsert":	"1000",
+			"bytesperinsert":	"524288",
 		})
 
 		knowndialects = [ "sqlite", "mysql" ]
 		if self._dbdef["dialect"] not in knowndialects:
 			raise InvalidArgumentException("dialect must be one of %s, but %s was given." % (", ".join(sorted(list(knowndialects))), self._dbdef["dialect"]))
 
-		self._f = FileWrapper(_strftimeexpand(self._dbdef["file"], args), args)
+		self._rowsperinsert = int(self._dbdef["rowsperinsert"])
+		self._bytesperinsert = int(self._dbdef["bytesperinsert"])
+		if self._args["line_buffered"]:
+			# Every interval needs to be visible to the reader immediately
+			self._rowsperinsert = 1
+		self._values = [ ]
+		self._valuebytes = 0
+
+		self._f = FileWrapper(_strftimeexpand(self._dbdef["file"], args), args, buffersize = 1024 * 1024)
 
 		if self._dbdef["dialect"] == "sqlite":
 			self._createdb_sqlite()
-			self.newinterval = self._newinterval_sqlite
-			self.close = self._close_sqlite
+			self._insertprefix = "INSERT INTO %(tablename)s (tfrom, tto, counts) VALUES\n" % self._dbdef
 		elif self._dbdef["dialect"] == "mysql":
 			self._createdb_mysql()
-			self.newinterval = self._newinterval_mysql
-			self.close = self._close_mysql
+			self._insertprefix = "INSERT INTO `%(tablename)s` (`tfrom`, `tto`, `counts`) VALUES\n" % self._dbdef
+
+	def _flushinsert(self):
+		if len(self._values) > 0:
+			self._f.write(self._insertprefix + ",\n".join(self._values) + ";\n")
+			self._values = [ ]
+			self._valuebytes = 0
+
+	def newinterval(self, fromtime, totime, counts):
+		values = "('%s', '%s', %d)" % (fromtime, totime, counts)
+		if (len(self._values) > 0) and (len(self._insertprefix) + self._valuebytes + len(values) + 2 > self._bytesperinsert):
+			# Would not fit into the current statement anymore
+			self._flushinsert()
+		self._values.append(values)
+		self._valuebytes += len(values) + 2
+		if len(self._values) >= self._rowsperinsert:
+			self._flushinsert()
+
+	def flush(self):
+		self._flushinsert()
+		self._f.flush()
 
 	def _createdb_sqlite(self):
 		print("BEGIN TRANSACTION;", file = self._f)
-		print("""CREATE TABLE IF NOT EXISTS %(dbname)s (
+		print("""CREATE TABLE IF NOT EXISTS %(tablename)s (
 			id integer PRIMARY KEY,
 			tfrom timestamp NOT NULL,
 			tto timestamp NOT NULL,
@@ -302,12 +862,6 @@ class OutputBackendSQL(OutputBackend):
 			CHECK(counts >= 0)
 		);""" % self._dbdef, file = self._f)
 
-	def _newinterval_sqlite(self, fromtime, totime, counts):
-		print("INSERT INTO data (tfrom, tto, counts) VALUES ('%s', '%s', %d);" % (fromtime, totime, counts), file = self._f)
-
-	def _close_sqlite(self):
-		print("COMMIT;", file = self._f)
-
 	def _createdb_mysql(self):
 		print("CREATE DATABASE /*!32312 IF NOT EXISTS*/ `%(dbname)s` /*!40100 DEFAULT CHARACTER SET utf8 */;" % self._dbdef, file = self._f)
 		print("CONNECT `%(dbname)s`;" % self._dbdef, file = self._f)
@@ -321,18 +875,20 @@ class OutputBackendSQL(OutputBackend):
 			CHECK(counts >= 0)
 		);""" % self._dbdef, file = self._f)
 
-	def _newinterval_mysql(self, fromtime, totime, counts):
-		print("INSERT INTO data (`tfrom`, `tto`, `counts`) VALUES ('%s', '%s', %d);" % (fromtime, totime, counts), file = self._f)
-
-	def _close_mysql(self):
+	def close(self):
+		self._flushinsert()
 		print("COMMIT;", file = self._f)
+		self._f.close()
 
 
 class OutputBackendMySQL(OutputBackend):
-	def __init__(self, connstring, args):
+	def __init__(self, connstring, args, dbconn = None):
+		"""dbconn may be any DB-API 2.0 connection object; if it is omitted, a
+		connection is established using PyMySQL and the connection string."""
 		OutputBackend.__init__(self, connstring, args)
-		if pymysql is None:
+		if (pymysql is None) and (dbconn is None):
 			raise InvalidArgumentException("The MySQL backend is not available from Python. Please install the PyMySQL pacakge available from http://www.pymysql.org")
+		self._log = logging.getLogger("gsu.output." + self.__class__.__name__)
 		self._dbdef = _parseconnstr(connstring, {
 			"host":			None,
 			"port":			None,
@@ -341,21 +897,31 @@ class OutputBackendMySQL(OutputBackend):
 			"password":		None,
 			"dbname":		"gammascout",
 			"tablename":	"data",
+			"batchsize":	"1000",
+			"bulkload":		"0",
 		})
 		if self._dbdef["port"] is not None:
 			self._dbdef["port"] = int(self._dbdef["port"])
-
-		connparams = {
-			"host":			self._dbdef["host"],
-			"user":			self._dbdef["user"],
-			"passwd":		self._dbdef["password"],
-			"port":			self._dbdef["port"],
-			"unixsocket":	self._dbdef["unixsocket"],
-		}
-		for key in list(connparams.keys()):
-			if connparams[key] is None:
-				del connparams[key]
-		self._db = pymysql.Connect(**connparams)
+		self._batchsize = int(self._dbdef["batchsize"])
+		if self._batchsize < 1:
+			raise InvalidArgumentException("MySQL batchsize must be at least 1, but %d was given." % (self._batchsize))
+		self._bulkload = self._dbdef["bulkload"] not in [ "0", "no", "false" ]
+
+		if dbconn is None:
+			connparams = {
+				"host":			self._dbdef["host"],
+				"user":			self._dbdef["user"],
+				"passwd":		self._dbdef["password"],
+				"port":			self._dbdef["port"],
+				"unixsocket":	self._dbdef["unixsocket"],
+			}
+			for key in list(connparams.keys()):
+				if connparams[key] is None:
+					del connparams[key]
+			if self._bulkload:
+				connparams["local_infile"] = True
+			dbconn = pymysql.Connect(**connparams)
+		self._db = dbconn
 		self._cursor = self._db.cursor()
 		self._cursor.execute("CREATE DATABASE /*!32312 IF NOT EXISTS*/ %s;" % (self._dbdef["dbname"]))
 		self._cursor.execute("USE %s;" % (self._dbdef["dbname"]))
@@ -367,24 +933,355 @@ class OutputBackendMySQL(OutputBackend):
 
 		self._cursor.execute("""CREATE TABLE IF NOT EXISTS `%(tablename)s` (
 			`id` int(12) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+			`serial` int(12) NULL,
 			`tfrom` timestamp NOT NULL,
 			`tto` timestamp NOT NULL,
 			`counts` int(8) NOT NULL,
+			KEY `serial_tfrom_idx` (`serial`, `tfrom`),
 			CHECK(tto > tfrom),
 			CHECK(counts >= 0)
 		);""" % self._dbdef)
+		self._cursor.execute("SHOW COLUMNS FROM `%(tablename)s` LIKE 'serial';" % self._dbdef)
+		if self._cursor.fetchone() is None:
+			# Table was created by an older version without device serial
+			self._cursor.execute("ALTER TABLE `%(tablename)s` ADD COLUMN `serial` int(12) NULL AFTER `id`, ADD INDEX `serial_tfrom_idx` (`serial`, `tfrom`);" % self._dbdef)
+
+		self._insertquery = "INSERT INTO `%(tablename)s` (`serial`, `tfrom`, `tto`, `counts`) VALUES (%%s, %%s, %%s, %%s);" % self._dbdef
+		self._serial = None
+		self._rows = [ ]
+		self._rowcount = 0
+		self._bulkfile = None
+		if self._bulkload:
+			self._bulkfile = tempfile.NamedTemporaryFile(mode = "w", encoding = "utf-8", prefix = "gsu_mysql_", suffix = ".tsv", delete = False)
 
 	def _exec_mayfail(self, sql):
 		try:
 			self._cursor.execute(sql)
-		except pymysql.err.IntegrityError:
+		except self._db.IntegrityError:
 			pass
 
+	def _flush(self):
+		if len(self._rows) > 0:
+			# executemany() of PyMySQL rewrites INSERT statements into
+			# multi-row VALUES lists, i.e. one round trip per batch
+			self._cursor.executemany(self._insertquery, self._rows)
+			self._rowcount += len(self._rows)
+			self._rows = [ ]
+
+	def _bulkinsert(self):
+		self._bulkfile.close()
+		try:
+			if self._rowcount > 0:
+				self._cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE `%s` FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' (`serial`, `tfrom`, `tto`, `counts`);" % (self._bulkfile.name.replace("\\", "\\\\").replace("'", "\\'"), self._dbdef["tablename"]))
+		finally:
+			os.unlink(self._bulkfile.name)
+
+	def setserial(self, serial):
+		self._serial = serial
+
 	def newinterval(self, fromtime, totime, counts):
-		self._cursor.execute("INSERT INTO data (`tfrom`, `tto`, `counts`) VALUES ('%s', '%s', %d);" % (fromtime, totime, counts))
+		if self._bulkfile is not None:
+			self._bulkfile.write("%s\t%s\t%s\t%d\n" % ("\\N" if (self._serial is None) else str(self._serial), fromtime, totime, counts))
+			self._rowcount += 1
+		else:
+			self._rows.append((self._serial, str(fromtime), str(totime), counts))
+			if len(self._rows) >= self._batchsize:
+				self._flush()
 
 	def close(self):
+		if self._bulkfile is not None:
+			self._bulkinsert()
+		else:
+			self._flush()
 		self._db.commit()
+		self._log.info("Inserted %d rows into MySQL table %s" % (self._rowcount, self._dbdef["tablename"]))
+
+
+class OutputBackendArchive(OutputBackend):
+	"""Writes intervals to a block-compressed columnar archive (see
+	ColumnArchive), which is small and allows fast reads of time ranges."""
+	def __init__(self, filename, args):
+		OutputBackend.__init__(self, filename, args)
+		self._archive = ColumnArchiveWriter(_strftimeexpand(filename, args), blocksize = args["archive_block_size"])
+
+	def newinterval(self, fromtime, totime, counts):
+		delta = (totime - fromtime)
+		duration = delta.days * 86400 + delta.seconds
+		self._archive.append(DatabaseSchema.datetime_to_epoch(fromtime), duration, counts)
+
+	def close(self):
+		self._archive.close()
+
+
+class OutputBackendJournal(OutputBackend):
+	"""Appends intervals to a crash-safe binary journal (see Journal) that is
+	synced to disk in groups, at most every --journal-sync seconds. An
+	existing journal is continued after cutting off a damaged tail."""
+	def __init__(self, filename, args):
+		OutputBackend.__init__(self, filename, args)
+		try:
+			self._journal = JournalWriter(_strftimeexpand(filename, args), syncsecs = args["journal_sync"])
+		except JournalException as e:
+			raise InvalidArgumentException(str(e))
+
+	def newinterval(self, fromtime, totime, counts):
+		delta = (totime - fromtime)
+		duration = delta.days * 86400 + delta.seconds
+		self._journal.append(DatabaseSchema.datetime_to_epoch(fromtime), duration, counts)
+
+	def close(self):
+		self._journal.close()
+
+
+class OutputBackendNPZ(OutputBackend):
+	"""Writes the intervals as columns into an uncompressed NumPy .npz file:
+	tfrom (datetime64[s], UTC), duration (seconds), counts and, with
+	--npz-doserate, usvperhr. Members are stored uncompressed so that they
+	can be memory-mapped when loading."""
+	def __init__(self, filename, args):
+		OutputBackend.__init__(self, filename, args)
+		if numpy is None:
+			raise InvalidArgumentException("The npz backend is not available from Python. Please install the NumPy package available from http://www.numpy.org")
+		self._filename = _strftimeexpand(filename, args)
+		self._tfrom = array.array("q")
+		self._duration = array.array("q")
+		self._counts = array.array("q")
+		if args["npz_doserate"]:
+			self._cache = FormatCache(args["date_format"])
+			self._usvperhr = array.array("d")
+		else:
+			self._usvperhr = None
+
+	def newinterval(self, fromtime, totime, counts):
+		delta = (totime - fromtime)
+		duration = delta.days * 86400 + delta.seconds
+		self._tfrom.append(DatabaseSchema.datetime_to_epoch(fromtime))
+		self._duration.append(duration)
+		self._counts.append(counts)
+		if self._usvperhr is not None:
+			self._usvperhr.append(self._cache.rates(counts, duration)[2])
+
+	def close(self):
+		columns = {
+			"tfrom":		numpy.frombuffer(self._tfrom, dtype = numpy.int64).astype("datetime64[s]"),
+			"duration":		numpy.frombuffer(self._duration, dtype = numpy.int64).astype(numpy.int32),
+			"counts":		numpy.frombuffer(self._counts, dtype = numpy.int64),
+		}
+		if self._usvperhr is not None:
+			columns["usvperhr"] = numpy.frombuffer(self._usvperhr, dtype = numpy.float64)
+		with open(self._filename, "wb") as f:
+			numpy.savez(f, **columns)
+
+	@staticmethod
+	def readdata(filename):
+		"""Yields (fromtime, totime, counts) for all intervals of an .npz file
+		written by this backend."""
+		if numpy is None:
+			raise InvalidArgumentException("Reading npz files requires the NumPy package available from http://www.numpy.org")
+		with numpy.load(filename) as npz:
+			try:
+				(tfrom, duration, counts) = (npz["tfrom"].astype(numpy.int64), npz["duration"], npz["counts"])
+			except KeyError as e:
+				raise InvalidArgumentException("'%s' was not written by the npz output backend (missing column %s)." % (filename, str(e)))
+		for (tfrom, duration, counts) in zip(tfrom.tolist(), duration.tolist(), counts.tolist()):
+			fromtime = DatabaseSchema.epoch_to_datetime(tfrom)
+			yield (fromtime, fromtime + datetime.timedelta(0, duration), counts)
+
+
+class OutputBackendInflux(OutputBackend):
+	"""Writes the intervals in the InfluxDB line protocol, either into a file
+	or to the HTTP write endpoint of a time series database. Every interval
+	becomes one point at its start time (in seconds) with the integer fields
+	counts and duration and the float field usvperhr; the device serial is
+	stored as a tag.
+
+	For HTTP, points are sent by a background thread in batches of at most
+	batchsize lines or after batchsecs seconds, whatever comes first, so that
+	the online mode pushes its readings in time and is never held up by the
+	server. Request bodies are gzip compressed. Failed requests are retried
+	with exponential backoff; if the endpoint stays unavailable, the lines are
+	kept and sending is suspended for an increasing amount of time. Never more
+	than maxpending lines are kept (the oldest are dropped first), so memory
+	use stays bounded even if online mode runs for days without a reachable
+	server. Batches that the server refuses are logged and dropped."""
+	_MAX_SUSPEND = 300
+	def __init__(self, connstring, args):
+		OutputBackend.__init__(self, connstring, args)
+		self._log = logging.getLogger("gsu.output." + self.__class__.__name__)
+		self._def = _parseconnstr(connstring, {
+			"file":			None,
+			"host":			None,
+			"port":			"8086",
+			"db":			"gammascout",
+			"measurement":	"radiation",
+			"batchsize":	"5000",
+			"batchsecs":	"10",
+			"gzip":			"1",
+			"retries":		"5",
+			"timeout":		"10",
+			"maxpending":	"100000",
+		})
+		if (self._def["file"] is None) == (self._def["host"] is None):
+			raise InvalidArgumentException("The influx backend needs either a file or a host in its connection string, but not both.")
+		self._batchsize = int(self._def["batchsize"])
+		self._batchsecs = float(self._def["batchsecs"])
+		self._gzip = self._def["gzip"] not in [ "0", "no", "false" ]
+		self._retries = int(self._def["retries"])
+		self._timeout = float(self._def["timeout"])
+		self._maxpending = max(int(self._def["maxpending"]), self._batchsize)
+		if self._batchsize < 1:
+			raise InvalidArgumentException("Influx batchsize must be at least 1, but %d was given." % (self._batchsize))
+
+		self._measurement = OutputBackendInflux._escape(self._def["measurement"])
+		self._prefix = self._measurement + " "
+		self._cache = FormatCache(None, tailformat = lambda counts, totalseconds, cps, cpm, usvperhr: "counts=%di,duration=%di,usvperhr=%r" % (counts, totalseconds, usvperhr))
+		self._lines = collections.deque()
+		self._linecount = 0
+		self._dropcount = 0
+		self._refusedcount = 0
+		self._lastpush = time.time()
+		self._suspendsecs = 0
+		self._nextattempt = 0
+		if self._def["file"] is not None:
+			self._f = FileWrapper(_strftimeexpand(self._def["file"], args), args)
+			self._url = None
+		else:
+			self._f = None
+			self._url = "http://%s:%d/write?%s" % (self._def["host"], int(self._def["port"]), urllib.parse.urlencode([ ("db", self._def["db"]), ("precision", "s") ]))
+			self._condition = threading.Condition()
+			self._closing = False
+			self._sender = threading.Thread(target = self._run)
+			self._sender.daemon = True
+			self._sender.start()
+
+	@staticmethod
+	def _escape(name):
+		return name.replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+	def setserial(self, serial):
+		if serial is None:
+			self._prefix = self._measurement + " "
+		else:
+			self._prefix = "%s,serial=%d " % (self._measurement, serial)
+
+	def _post(self, body):
+		"""Sends one request and returns True on success, False if it may be
+		retried and None if the server refused the data."""
+		headers = { "Content-Type": "text/plain; charset=utf-8" }
+		if self._gzip:
+			body = gzip.compress(body)
+			headers["Content-Encoding"] = "gzip"
+		request = urllib.request.Request(self._url, data = body, headers = headers, method = "POST")
+		try:
+			with urllib.request.urlopen(request, timeout = self._timeout) as response:
+				response.read()
+			return True
+		except urllib.error.HTTPError as e:
+			if (e.code == 429) or (e.code >= 500):
+				self._log.warning("Server at %s is unavailable (HTTP %d)" % (self._url, e.code))
+				return False
+			self._log.error("Server at %s refused data (HTTP %d): %s" % (self._url, e.code, e.read().decode("utf-8", errors = "replace").strip()))
+			return None
+		except (urllib.error.URLError, OSError) as e:
+			self._log.warning("Cannot reach %s: %s" % (self._url, str(e)))
+			return False
+
+	def _push(self):
+		"""Sends all pending lines in batches. Returns False if the server could
+		not be reached even after retrying; the lines are kept then."""
+		self._lastpush = time.time()
+		while True:
+			with self._condition:
+				batch = [ self._lines.popleft() for i in range(min(self._batchsize, len(self._lines))) ]
+			if len(batch) == 0:
+				return True
+			body = "".join(batch).encode("utf-8")
+			for attempt in range(self._retries + 1):
+				if attempt > 0:
+					time.sleep(min(0.5 * (2 ** (attempt - 1)), 30))
+				result = self._post(body)
+				if result is not False:
+					break
+			if result is None:
+				# Retrying would not help, the lines are lost
+				self._refusedcount += len(batch)
+			elif not result:
+				with self._condition:
+					# New lines may have arrived meanwhile
+					self._lines.extendleft(reversed(batch))
+					while len(self._lines) > self._maxpending:
+						self._lines.popleft()
+						self._dropcount += 1
+				return False
+
+	def _pushdue(self):
+		"""Waits until lines are due to be sent. Returns False when closing.
+		Must be called with the condition held."""
+		while not self._closing:
+			now = time.time()
+			if len(self._lines) == 0:
+				wakeup = None
+			elif len(self._lines) >= self._batchsize:
+				wakeup = self._nextattempt
+			else:
+				wakeup = max(self._nextattempt, self._lastpush + self._batchsecs)
+			if (wakeup is not None) and (wakeup <= now):
+				return True
+			self._condition.wait(None if (wakeup is None) else wakeup - now)
+		return False
+
+	def _run(self):
+		while True:
+			with self._condition:
+				if not self._pushdue():
+					return
+			if self._push():
+				self._suspendsecs = 0
+			else:
+				self._suspendsecs = min(max(2 * self._suspendsecs, self._batchsecs), OutputBackendInflux._MAX_SUSPEND)
+				self._nextattempt = time.time() + self._suspendsecs
+				self._log.error("Keeping %d lines, next attempt to reach %s in %.0f sec" % (len(self._lines), self._url, self._suspendsecs))
+
+	def newinterval(self, fromtime, totime, counts):
+		delta = (totime - fromtime)
+		totalseconds = delta.days * 86400 + delta.seconds
+		line = "%s%s %d\n" % (self._prefix, self._cache.tail(counts, totalseconds), DatabaseSchema.datetime_to_epoch(fromtime))
+		self._linecount += 1
+		if self._f is not None:
+			self._f.write(line)
+			return
+
+		with self._condition:
+			self._lines.append(line)
+			if len(self._lines) > self._maxpending:
+				self._lines.popleft()
+				self._dropcount += 1
+			if (len(self._lines) == 1) or (len(self._lines) == self._batchsize):
+				# The sender may be waiting without timeout or for a full batch
+				self._condition.notify()
+
+	def flush(self):
+		if self._f is not None:
+			self._f.flush()
+
+	def close(self):
+		if self._f is not None:
+			self._f.close()
+			self._log.info("Wrote %d lines" % (self._linecount))
+			return
+
+		with self._condition:
+			self._closing = True
+			self._condition.notify()
+		self._sender.join()
+		sent = self._push()
+		if self._dropcount > 0:
+			self._log.error("Dropped %d lines because %s was unreachable for too long" % (self._dropcount, self._url))
+		if not sent:
+			raise InvalidArgumentException("Could not send %d lines to %s." % (len(self._lines), self._url))
+		if self._refusedcount > 0:
+			raise InvalidArgumentException("Server at %s refused %d lines." % (self._url, self._refusedcount))
+		self._log.info("Sent %d lines to %s" % (self._linecount - self._dropcount, self._url))
 
 
 def getbackendbyname(name):
@@ -396,5 +1293,10 @@ def getbackendbyname(name):
 		"xml":		OutputBackendXML,
 		"sql":		OutputBackendSQL,
 		"mysql":	OutputBackendMySQL,
+		"archive":	OutputBackendArchive,
+		"npz":		OutputBackendNPZ,
+		"store":	OutputBackendStore,
+		"influx":	OutputBackendInflux,
+		"journal":	OutputBackendJournal,
 	}[name]
 
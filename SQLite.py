@@ -30,9 +30,14 @@ class SQLite(object):
 	_debug = False
 	_debugthreshold = 0.05
 
-	def __init__(self, filename, closecommit = False, detect_types = False, **kwargs):
+	def __init__(self, filename, closecommit = False, detect_types = False, busyretries = 0, **kwargs):
+		"""Additional keyword arguments are passed to sqlite3.connect(); in
+		particular, timeout sets the time that SQLite waits for a lock held by
+		another connection. When the lock still cannot be acquired, the
+		statement is retried up to busyretries times."""
 		self._closecommit = closecommit
 		self._commitctr = 0
+		self._busyretries = busyretries
 		if filename is not None:
 			if not detect_types:
 				self._conn = sqlite3.connect(filename, **kwargs)
@@ -41,7 +46,7 @@ class SQLite(object):
 			self._cursor = self._conn.cursor()
 
 	def cursor(self):
-		clone = SQLite(None, self._closecommit)
+		clone = SQLite(None, self._closecommit, busyretries = self._busyretries)
 		clone._conn = self._conn
 		clone._cursor = self._conn.cursor()
 		return clone
@@ -56,8 +61,22 @@ class SQLite(object):
 		if self._closecommit:
 			self.commit()
 
+	@staticmethod
+	def _islocked(exception):
+		msg = str(exception)
+		return ("database is locked" in msg) or ("database is busy" in msg)
+
+	def _retry(self, function, *args):
+		for attempt in range(self._busyretries + 1):
+			try:
+				return function(*args)
+			except sqlite3.OperationalError as e:
+				if (not SQLite._islocked(e)) or (attempt == self._busyretries):
+					raise
+			time.sleep(0.1 * (2 ** min(attempt, 5)))
+
 	def commit(self):
-		self._conn.commit()
+		self._retry(self._conn.commit)
 
 	def fetchmany(self, howmany = 500):
 		return self._cursor.fetchmany(size = howmany)
@@ -65,7 +84,7 @@ class SQLite(object):
 	def execute(self, query, *args):
 		if SQLite._debug:
 			t0 = time.time()
-		self._cursor.execute(query, args)
+		self._retry(self._cursor.execute, query, args)
 		if SQLite._debug:
 			t1 = time.time()
 			t = t1 - t0
@@ -73,6 +92,26 @@ class SQLite(object):
 				print("Query '%s': %.1f" % (query, t))
 		return self
 
+	def executemany(self, query, rows):
+		if SQLite._debug:
+			t0 = time.time()
+		if not isinstance(rows, (list, tuple)):
+			rows = list(rows)
+		self._retry(self._cursor.executemany, query, rows)
+		if SQLite._debug:
+			t1 = time.time()
+			t = t1 - t0
+			if t > SQLite._debugthreshold:
+				print("Query '%s' (many): %.1f" % (query, t))
+		return self
+
+	def pragma(self, name, value):
+		"""Sets a pragma. Pragma values cannot be bound as parameters, so the
+		caller has to make sure that value is a sane, trusted identifier or
+		number."""
+		assert(isinstance(name, str))
+		return self.execute("PRAGMA %s = %s;" % (name, str(value)))
+
 	def execute_autocommit(self, query, *args):
 		self._commitctr += 1
 		if self._commitctr > 1000:
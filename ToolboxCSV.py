@@ -0,0 +1,88 @@
+#
+#	GammaScoutUtil - Tool to communicate with Gamma Scout Geiger counters.
+#	Copyright (C) 2011-2013 Johannes Bauer
+#
+#	This file is part of GammaScoutUtil.
+#
+#	GammaScoutUtil is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	GammaScoutUtil is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with GammaScoutUtil; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import csv
+import logging
+import datetime
+
+from Exceptions import InvalidArgumentException
+from CompressedFile import CompressedFile
+
+class gscsv:
+	delimiter = ';'
+	quotechar = "'"
+	escapechar = None
+	doublequote = True
+	skipinitialspace = False
+	lineterminator = '\r\n'
+	quoting = csv.QUOTE_MINIMAL
+
+class ToolboxCSV():
+	"""Reads CSV exports of the vendor's Gamma Scout Toolbox software, which
+	look like this:
+
+		date;time;puls;interval[s];dH/dt[uSv/h];comment
+		01.01.2010;00:00:00;;;;New timestamp
+		01.01.2010;00:02:00;3;120;0.010437;
+
+	The time is the end of the interval. Rows without counts are events like
+	"New timestamp" and are skipped, as is the dose rate, which is computed
+	from the counts again. Files are read row by row, so their size does not
+	matter."""
+	_HEADER = "date;time;puls;"
+
+	@staticmethod
+	def isexport(filename):
+		try:
+			with CompressedFile.open(filename, "r") as f:
+				return f.readline(len(ToolboxCSV._HEADER)) == ToolboxCSV._HEADER
+		except (IOError, UnicodeDecodeError):
+			return False
+
+	@staticmethod
+	def _parsetime(date, time):
+		(day, month, year) = date.split(".")
+		(hour, minute, second) = time.split(":")
+		return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+
+	@staticmethod
+	def readdata(filename):
+		"""Yields (fromtime, totime, counts) for every measurement."""
+		log = logging.getLogger("gsu.fileops." + __class__.__name__)
+		skipped = 0
+		with CompressedFile.open(filename, "r") as f:
+			for (lineno, row) in enumerate(csv.reader(f, dialect = gscsv), 1):
+				if lineno == 1:
+					if ";".join(row[:3]) + ";" != ToolboxCSV._HEADER:
+						raise InvalidArgumentException("'%s' is not a Gamma Scout Toolbox CSV export (unexpected header)." % (filename))
+					continue
+				if (len(row) < 4) or (row[2] == "") or (row[3] == ""):
+					skipped += 1
+					continue
+				try:
+					totime = ToolboxCSV._parsetime(row[0], row[1])
+					(counts, interval) = (int(row[2]), int(row[3]))
+				except ValueError:
+					raise InvalidArgumentException("Line %d of '%s' is malformed: %s" % (lineno, filename, ";".join(row)))
+				yield (totime - datetime.timedelta(0, interval), totime, counts)
+		log.debug("Skipped %d rows without measurement in '%s'" % (skipped, filename))